@@ -1,6 +1,50 @@
-from .collections import ObjectRedis, RedisDict, \
-     RedisList, RedisSet, RedisSortedSet
-from .ttl import RedisTTLSet, RedisTime
+import sys
 
 __version__ = '0.8.0'
 VERSION = tuple(map(int, __version__.split('.')))
+
+# The public names, by the module that defines them.  Where the language
+# allows, they're imported when first used, so importing pyredis (or just
+# its version) doesn't import redis-py.
+_EXPORTS = {
+    'ObjectRedis': 'collections',
+    'RedisCappedList': 'collections',
+    'RedisCounter': 'collections',
+    'RedisDict': 'collections',
+    'RedisList': 'collections',
+    'RedisSet': 'collections',
+    'RedisSortedSet': 'collections',
+    'FixedWindowLimiter': 'ratelimit',
+    'SlidingWindowLimiter': 'ratelimit',
+    'TokenBucketLimiter': 'ratelimit',
+    'RedisMirror': 'mirror',
+    'Scheduler': 'scheduler',
+    'dump_namespace': 'snapshot',
+    'restore_namespace': 'snapshot',
+    'RedisTTLDict': 'ttl',
+    'RedisTTLSet': 'ttl',
+    'RedisTime': 'ttl',
+    'TTLSweeper': 'ttl',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def _load(name):
+    module = __import__(_EXPORTS[name], globals(), level=1, fromlist=[name])
+    value = globals()[name] = getattr(module, name)
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _EXPORTS:
+            raise AttributeError('module %r has no attribute %r' %
+                                 (__name__, name))
+        return _load(name)
+
+    def __dir__():
+        return sorted(set(globals()) | set(_EXPORTS))
+else:
+    for _name in _EXPORTS:
+        _load(_name)
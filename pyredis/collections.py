@@ -1,15 +1,46 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from redis import StrictRedis
+from redis.client import BasePipeline
+from redis.exceptions import NoScriptError, ResponseError, WatchError
+import hashlib
+import heapq
+import itertools
+import os
 import pickle
-from collections import MutableMapping, MutableSequence, MutableSet
+from collections import Mapping, MutableMapping, MutableSequence, MutableSet
+from operator import itemgetter
 from ._compat import iteritems, OrderedDict
 import string
 import random
+import struct
+import threading
+import weakref
 
 __author__ = 'ke4roh'
 
 
+_default = [None, None]
+_default_lock = threading.Lock()
+
+
+def _default_redis():
+    """
+    :return: The StrictRedis to use when none is given, created when first
+        needed rather than at import, and again in each forked process
+    """
+    with _default_lock:
+        if _default[0] != os.getpid():
+            _default[:] = [os.getpid(), StrictRedis()]
+        return _default[1]
+
+
+def _server_version(redis):
+    """:return: The server's version, as a tuple of (major, minor)"""
+    version = redis.info('server')['redis_version']
+    return tuple(int(v) for v in version.split('.')[:2])
+
+
 class ObjectRedis(MutableMapping):
     """
     A Dictionary view of a Redis database, supporting object keys and arbitrary
@@ -23,7 +54,7 @@ class ObjectRedis(MutableMapping):
 
     def __init__(self, redis=None, namespace=None, serializer=pickle,
                  key_serializer=pickle, missing=None, missing_ttl=None,
-                 *args, **kwargs):
+                 wrapper_cache=0, *args, **kwargs):
         """
         :param redis: The StrictRedis connection to use
         :param namespace: Prepended to keys, None to prepend nothing.  If
@@ -39,14 +70,20 @@ class ObjectRedis(MutableMapping):
              collection (default = raise KeyError)
         :param missing_ttl: A function to return the TTL for values inserted
              by the missing call (default is None - i.e. no expiration)
+        :param wrapper_cache: The number of collection wrappers to keep and
+             return again for the same key without checking its type in
+             Redis (default 0 - check every time).  Wrappers are forgotten
+             when their keys are set or deleted through this object, but a
+             key that changes type by other means must not be cached.
         """
         self.redis = redis or StrictRedis(*args, **kwargs)
-        self.namespace = None
-        if namespace is not None:
-            self.namespace = ((type(namespace) is bytes and namespace) or
-                              str(namespace).encode('utf-8')) + b":::"
+        self.namespace = _namespace_prefix(namespace)
         self.serializer = serializer
         self.key_serializer = key_serializer
+        self.indexes = {}
+        self.wrapper_cache = wrapper_cache
+        self.__wrappers = OrderedDict()
+        self.__wrappers_lock = threading.Lock()
         if missing is not None:
             self.__missing__ = missing
         if missing_ttl is not None:
@@ -59,6 +96,9 @@ class ObjectRedis(MutableMapping):
         :return: The value at that key
         """
         rkey = self._ns(key)
+        cached = self.__wrappers.get(rkey)
+        if cached is not None:
+            return self.__wrap(rkey, type(cached))
         rtype = self.redis.type(rkey)
         if rtype == b'none':
             return self.__memoize(key)
@@ -68,17 +108,59 @@ class ObjectRedis(MutableMapping):
                 return self.serializer.loads(bval)
             return self.__memoize(key)  # typed, vanished, fetched
         elif rtype == b'list':
-            return RedisList(rkey, self.redis, self.serializer)
+            return self.__wrap(rkey, RedisList)
         elif rtype == b'set':
-            return RedisSet(rkey, self.redis, self.serializer)
+            return self.__wrap(rkey, RedisSet)
         elif rtype == b'hash':
-            return RedisDict(rkey, self.redis,
-                             self.serializer, self.key_serializer)
+            return self.__wrap(rkey, RedisDict)
         elif rtype == b'zset':
-            return RedisSortedSet(rkey, self.redis, self.serializer)
+            return self.__wrap(rkey, RedisSortedSet)
         else:
             raise NotImplementedError(str(rtype))
 
+    def __wrap(self, rkey, cls):
+        """
+        :return: A wrapper of class cls for the key rkey, from the cache if
+            there's one there
+        """
+        with self.__wrappers_lock:
+            wrapper = self.__wrappers.pop(rkey, None)
+            if type(wrapper) is not cls:
+                if cls is RedisDict:
+                    wrapper = RedisDict(rkey, self.redis, self.serializer,
+                                        self.key_serializer)
+                else:
+                    wrapper = cls(rkey, self.redis, self.serializer)
+            if self.wrapper_cache > 0:
+                # Most recently used last
+                self.__wrappers[rkey] = wrapper
+                while len(self.__wrappers) > self.wrapper_cache:
+                    del self.__wrappers[next(iter(self.__wrappers))]
+            return wrapper
+
+    def __forget(self, rkey):
+        with self.__wrappers_lock:
+            self.__wrappers.pop(rkey, None)
+
+    def list_at(self, key):
+        """
+        :return: A RedisList for key, without checking the type of what's
+            stored there, if anything
+        """
+        return self.__wrap(self._ns(key), RedisList)
+
+    def set_at(self, key):
+        """:return: A RedisSet for key, like list_at"""
+        return self.__wrap(self._ns(key), RedisSet)
+
+    def dict_at(self, key):
+        """:return: A RedisDict for key, like list_at"""
+        return self.__wrap(self._ns(key), RedisDict)
+
+    def sorted_set_at(self, key):
+        """:return: A RedisSortedSet for key, like list_at"""
+        return self.__wrap(self._ns(key), RedisSortedSet)
+
     def __memoize(self, key):
         val = self.__missing__(key)
         self.set(key, val, self.__missing_ttl__(key))
@@ -100,54 +182,68 @@ class ObjectRedis(MutableMapping):
         Set an item in the collection, constant time O(1)
         :param key: the key to set (within the namespace of this ObjectRedis)
         :param value: the value to set
-        :param ttl: the duration, in seconds, this value should live
+        :param ttl: the duration, in seconds, this value should live.  Its
+            index entries outlive it, until a query finds them.
         :return: None
         """
         key.__hash__()
         bkey = self._ns(key)
+        self.__forget(bkey)
         d = dir(value)
         if "__imul__" in d and "__iter__" in d:  # list
             def new_list(pipe):
+                pipe.multi()
                 rl = RedisList(bkey, pipe, self.serializer)
                 rl.clear()
                 rl.extend(value)
                 if ttl is not None:
                     pipe.expire(bkey, ttl)
+                self.__index(pipe, bkey, value)
 
-            self.redis.transaction(new_list, key)
+            _transaction(self.redis, new_list, bkey)
         elif "__xor__" in d and "__iter__" in d:  # set
             def new_set(pipe):
+                pipe.multi()
                 rs = RedisSet(bkey, pipe, self.serializer)
                 rs.clear()
                 rs.update(value)
                 if ttl is not None:
                     pipe.expire(bkey, ttl)
+                self.__index(pipe, bkey, value)
 
-            self.redis.transaction(new_set, key)
+            _transaction(self.redis, new_set, bkey)
         elif "__getitem__" in d and 'index' not in d:  # hash
             def new_hash(pipe):
+                pipe.multi()
                 rd = RedisDict(bkey, pipe, self.serializer, self.serializer)
                 rd.clear()
                 rd.update(value)
                 if ttl is not None:
                     pipe.expire(bkey, ttl)
+                self.__index(pipe, bkey, value)
 
-            self.redis.transaction(new_hash, key)
+            _transaction(self.redis, new_hash, bkey)
         elif "__getitem__" in d and 'values' in d:  # zset
             def new_zset(pipe):
+                pipe.multi()
                 rz = RedisSortedSet(bkey, pipe, self.serializer)
                 rz.clear()
                 rz.update(value)
                 if ttl is not None:
                     pipe.expire(bkey, ttl)
+                self.__index(pipe, bkey, value)
 
-            self.redis.transaction(new_zset, key)
+            _transaction(self.redis, new_zset, bkey)
         else:  # string (other)
+            pipe = self.redis.pipeline() if self.indexes else self.redis
             if ttl is None:
-                self.redis.set(name=bkey, value=self.serializer.dumps(value))
+                pipe.set(name=bkey, value=self.serializer.dumps(value))
             else:
-                self.redis.setex(name=bkey, time=ttl,
-                                 value=self.serializer.dumps(value))
+                pipe.setex(name=bkey, time=ttl,
+                           value=self.serializer.dumps(value))
+            if self.indexes:
+                self.__index(pipe, bkey, value)
+                _execute(pipe)
 
     def __contains__(self, key):
         """
@@ -161,17 +257,137 @@ class ObjectRedis(MutableMapping):
         Remove an item from the collection O(1)
         :raises KeyError if the key is not in the collection
         """
-        if self.redis.delete(self._ns(key)) == 0:
+        bkey = self._ns(key)
+        self.__forget(bkey)
+        if self.indexes:
+            pipe = self.redis.pipeline()
+            pipe.delete(bkey)
+            self.__index(pipe, bkey, _NOT_GIVEN)
+            deleted = _execute(pipe)[0]
+        else:
+            deleted = self.redis.delete(bkey)
+        if deleted == 0:
             raise KeyError(str(key))
 
+    def add_index(self, name, extractor, lex=False):
+        """
+        Maintain an index of the values in this namespace, so they can be
+        found by query rather than by scanning them all.  The index is
+        updated in the same transaction as each set or delete through this
+        ObjectRedis (other instances must add the same index to keep it up
+        to date).  Values already stored are indexed by reindex.
+        :param name: The name of the index
+        :param extractor: A function(value) returning the value's position
+            in the index, or None to leave it out
+        :param lex: False if the extractor returns numbers, True if it
+            returns strings (str or bytes, without NUL characters), to be
+            ordered by their bytes
+        """
+        name = _index_name(name)
+        self.indexes[name] = (extractor, lex)
+
+    def drop_index(self, name):
+        """Stop maintaining an index and remove it from Redis"""
+        name = _index_name(name)
+        del self.indexes[name]
+        self.redis.delete(self.__index_key(name), self.__reverse_key(name))
+
+    def reindex(self, name):
+        """
+        Rebuild an index from every value in this namespace.  O(N)
+        """
+        name = _index_name(name)
+        self.redis.delete(self.__index_key(name), self.__reverse_key(name))
+
+        def write(pipe, chunk):
+            for bkey, value in chunk:
+                self.__index(pipe, bkey, value, (name,))
+
+        _write_chunks(self.redis, write,
+                      _chunked((self._ns(k), v) for k, v in self.items()))
+
+    def query(self, name, min=None, max=None, values=False, offset=0,
+              count=None):
+        """
+        Find entries by an index.  Entries for keys that no longer exist,
+        such as values set with a ttl that have since expired, are left out
+        and removed from the index.  O(log(N) + offset + M + the number
+        removed)
+        :param name: The name of the index (see add_index)
+        :param min: The least indexed value to include, None for no limit
+        :param max: The greatest indexed value to include, None for no limit
+        :param values: False to return the keys, True to return (key, value)
+            pairs, fetched in one round trip
+        :param offset: The number of matches to skip
+        :param count: The most matches to return, None for all of them
+        :return: A list of keys or (key, value) pairs, in index order
+        """
+        name = _index_name(name)
+        extractor, lex = self.indexes[name]
+        if lex:
+            bounds = [b'-' if min is None else b'[' + _lex_value(min),
+                      # Members are value + NUL + key, so all of them with
+                      # the value max sort before max + \x01
+                      b'+' if max is None else
+                      b'(' + _lex_value(max) + b'\x01']
+        else:
+            bounds = ['-inf' if min is None else min,
+                      '+inf' if max is None else max]
+        bkeys = _QUERY_INDEX(
+            self.redis,
+            keys=[self.__index_key(name), self.__reverse_key(name)],
+            args=[1 if lex else 0] + bounds +
+            [offset, -1 if count is None else count])
+        if not values:
+            return [self._dns(k) for k in bkeys]
+        pipe = self.redis.pipeline(transaction=False)
+        for k in bkeys:
+            pipe.get(k)
+        results = []
+        for k, v in zip(bkeys, pipe.execute(raise_on_error=False)):
+            key = self._dns(k)
+            if isinstance(v, ResponseError):  # a collection, not a string
+                try:
+                    results.append((key, self[key]))
+                except KeyError:
+                    pass
+            elif v is not None:  # None if it was deleted since the query
+                results.append((key, self.serializer.loads(v)))
+        return results
+
+    def __index_key(self, name):
+        return b'-=-INDEX-=-' + (self.namespace or b'') + name
+
+    def __reverse_key(self, name):
+        return b'-=-INDEX-REVERSE-=-' + (self.namespace or b'') + name
+
+    def __index(self, pipe, bkey, value, names=None):
+        """
+        Queue commands to update the indexes for one entry
+        :param pipe: The pipeline to use
+        :param bkey: The key, as stored in redis
+        :param value: The new value, or _NOT_GIVEN if it's being deleted
+        :param names: The names of the indexes to update, default all
+        """
+        for name in names or self.indexes:
+            extractor, lex = self.indexes[name]
+            position = None if value is _NOT_GIVEN else extractor(value)
+            if lex:
+                _LEX_INDEX(pipe, keys=[self.__index_key(name),
+                                       self.__reverse_key(name)],
+                           args=[bkey, b'' if position is None else
+                                 _lex_value(position) + b'\x00' + bkey])
+            elif position is None:
+                pipe.zrem(self.__index_key(name), bkey)
+            else:
+                pipe.zadd(self.__index_key(name), position, bkey)
+
     def __iter__(self):
         """
         Return an iterator over the keys in this object.  Time is proportional
         to the number of keys in this namespace.
         """
-        for k in self.redis.scan_iter(
-                match=((self.namespace is not None and
-                        self.namespace + b'*') or None)):
+        for k in self.__scan():
             try:
                 # _dns can't be done in a list comprehension because the
                 # exceptions need to be handled in the case of a null namespace
@@ -188,6 +404,102 @@ class ObjectRedis(MutableMapping):
         """
         return sum(1 for _ in self.__iter__())
 
+    def __scan(self):
+        """Generate the keys in Redis that may be in this namespace"""
+        return self.redis.scan_iter(
+            match=(self.namespace is not None and
+                   _glob_escape(self.namespace) + b'*') or None,
+            count=_CHUNK_SIZE)
+
+    def _stored_keys(self):
+        """
+        Generate the keys in Redis that are in this namespace, as __iter__
+        finds them: not those of other namespaces, even nested ones, whose
+        keys share the prefix
+        """
+        for k in self.__scan():
+            try:
+                self._dns(k)
+            except Exception:  # Not one of ours
+                continue
+            yield k
+
+    def __moves(self, namespace):
+        """
+        :param namespace: Another namespace, as given to the constructor
+        :return: A generator of (key, the same key in namespace)
+        """
+        prefix = _namespace_prefix(namespace)
+        keys = self._stored_keys()
+        if prefix is not None and (self.namespace is None or
+                                   prefix.startswith(self.namespace)):
+            # New keys would turn up in the scan; finish it first
+            keys = list(keys)
+        start = len(self.namespace or b'')
+        return ((k, (prefix or b'') + k[start:]) for k in keys)
+
+    def clear(self):
+        """
+        Delete every key in this namespace, and the indexes, a batch at a
+        time, with UNLINK where the server has it.  O(N)
+        """
+        with self.__wrappers_lock:
+            self.__wrappers.clear()
+        _delete_all(self.redis, self._stored_keys())
+        for name in self.indexes:
+            self.redis.delete(self.__index_key(name), self.__reverse_key(name))
+
+    def copy_to(self, namespace, replace=False):
+        """
+        Copy every key in this namespace to another, on the server, with
+        COPY (Redis 6.2+) or DUMP and RESTORE, pipelined.  TTLs are copied
+        too.  Indexes aren't; add them to the copy and reindex.  O(N)
+        :param namespace: The namespace to copy to, as for the constructor
+        :param replace: True to overwrite keys that exist there, False to
+            leave them as they are
+        :return: An ObjectRedis for the copy
+        """
+        moves = self.__moves(namespace)
+        first = next(moves, None)
+        if first is not None:
+            src, dst = first
+            args = ('REPLACE',) if replace else ()
+            try:
+                self.redis.execute_command('COPY', src, dst, *args)
+            except ResponseError:  # before Redis 6.2
+                _dump_restore(self.redis, itertools.chain([first], moves),
+                              replace)
+            else:
+                _write_chunks(
+                    self.redis,
+                    lambda client, chunk: [
+                        client.execute_command('COPY', s, d, *args)
+                        for s, d in chunk],
+                    _chunked(moves))
+        return ObjectRedis(self.redis, namespace, self.serializer,
+                           self.key_serializer)
+
+    def rename_namespace(self, namespace):
+        """
+        Move every key in this namespace to another, renaming a batch at a
+        time in pipelined scripts, overwriting keys that exist there, and
+        carry on as that namespace.  Keys that expire or are deleted while
+        it runs are skipped.  Registered indexes are rebuilt.  Not atomic.
+        O(N)
+        :param namespace: The new namespace, as for the constructor
+        """
+        _write_chunks(self.redis,
+                      lambda client, chunk: _RENAME_EXISTING(
+                          client, keys=[k for move in chunk for k in move]),
+                      _chunked(self.__moves(namespace)))
+        for name in self.indexes:
+            self.redis.delete(self.__index_key(name), self.__reverse_key(name))
+        with self.__wrappers_lock:
+            self.__wrappers.clear()
+        self.namespace = _namespace_prefix(namespace)
+        for name in self.indexes:
+            self.reindex(name)
+
     def _dns(self, key):
         """
         decode a stored key by removing the namespace and deserializing it
@@ -254,10 +566,82 @@ def _repr(obj, box=None, meta="name"):
             break
         items_to_print.append(one(i))
     return ('<%s(%s=%r,' + box + ')>') % \
-           (obj.__class__.__name__, meta, obj.__dict__.get(meta),
+           (obj.__class__.__name__, meta, getattr(obj, meta, None),
             ', '.join(items_to_print))
 
 
+def _namespace_prefix(namespace):
+    """:return: The prefix of keys in namespace, None for no namespace"""
+    if namespace is None:
+        return None
+    return ((type(namespace) is bytes and namespace) or
+            str(namespace).encode('utf-8')) + b":::"
+
+
+def _glob_escape(prefix):
+    """Escape the characters special to SCAN MATCH"""
+    for c in (b'\\', b'*', b'?', b'[', b']'):
+        prefix = prefix.replace(c, b'\\' + c)
+    return prefix
+
+
+def _delete_all(redis, keys):
+    """
+    Delete keys, in pipelined batches, with UNLINK (Redis 4+) to free them
+    in the background, or else DEL
+    :param keys: An iterable of keys
+    """
+    chunks = _chunked(keys)
+    first = next(chunks, None)
+    if first is None:
+        return
+    command = 'UNLINK'
+    try:
+        redis.execute_command(command, *first)
+    except ResponseError:
+        command = 'DEL'
+        redis.delete(*first)
+    _write_chunks(redis,
+                  lambda client, chunk: client.execute_command(command,
+                                                               *chunk),
+                  chunks)
+
+
+def _dump_restore(redis, moves, replace):
+    """
+    Copy keys with DUMP and RESTORE, keeping their TTLs
+    :param moves: An iterable of (source, destination) pairs
+    :param replace: True to overwrite existing destinations
+    """
+    for chunk in _chunked(moves):
+        pipe = redis.pipeline(transaction=False)
+        for src, dst in chunk:
+            pipe.dump(src)
+            pipe.pttl(src)
+        dumped = pipe.execute()
+        for (src, dst), value, ttl in zip(chunk, dumped[::2], dumped[1::2]):
+            if value is not None:  # Gone since the scan
+                pipe.restore(dst, max(ttl, 0), value, replace=replace)
+        for result in pipe.execute(raise_on_error=False):
+            # Without replace, keys that exist are left alone
+            if isinstance(result, ResponseError) and \
+                    (replace or not str(result).startswith('BUSYKEY')):
+                raise result
+
+
+def _index_name(name):
+    return name if type(name) is bytes else str(name).encode('utf-8')
+
+
+def _lex_value(value):
+    """Encode a value for a lex index"""
+    if type(value) is not bytes:
+        value = value.encode('utf-8')
+    if b'\x00' in value:
+        raise ValueError('Lex index values may not contain NUL')
+    return value
+
+
 _TOKEN_CHARS = (string.ascii_letters + string.digits)
 
 
@@ -266,6 +650,436 @@ def _token():
         encode("utf8")
 
 
+_NOT_GIVEN = object()
+
+# Bulk writes are split into commands of at most this many items, so neither
+# the client nor the server has to hold one enormous command ...
+_CHUNK_SIZE = 1000
+# ... and sent this many commands per round trip.
+_CHUNKS_PER_TRIP = 10
+
+
+def _chunked(iterable, size=None):
+    """Generate lists of up to size items from iterable, consuming it lazily"""
+    size = size or _CHUNK_SIZE
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_chunks(redis, write, chunks):
+    """
+    Send a command for each chunk, pipelined.
+    :param redis: The StrictRedis to use.  If it's a pipeline already, the
+        commands go to it and it's left to the caller to execute.
+    :param write: A function(client, chunk) to send one command
+    :param chunks: An iterable of chunks, as from _chunked
+    :return: The result of each command, or None if redis is a pipeline
+    """
+    if isinstance(redis, BasePipeline):
+        for chunk in chunks:
+            write(redis, chunk)
+        return None
+    results = []
+    pipe = redis.pipeline(transaction=False)
+    for i, chunk in enumerate(chunks, 1):
+        write(pipe, chunk)
+        if i % _CHUNKS_PER_TRIP == 0:
+            results.extend(_execute(pipe))
+    results.extend(_execute(pipe))
+    return results
+
+
+def _changes_channel(name):
+    """:return: The channel where a collection's changes are published"""
+    return (name if isinstance(name, bytes) else name.encode('utf-8')) + \
+        b':changes'
+
+
+def _pack_fields(fields):
+    """Encode the serialized fields or members changed, for publishing"""
+    return b''.join(struct.pack('>I', len(f)) + f for f in fields)
+
+
+def _unpack_fields(message):
+    """Decode a message from _pack_fields"""
+    fields = []
+    i = 0
+    while i < len(message):
+        n, = struct.unpack('>I', message[i:i + 4])
+        fields.append(message[i + 4:i + 4 + n])
+        i += 4 + n
+    return fields
+
+
+def _publish(collection, client, fields):
+    """
+    Queue or send the news that fields of a collection changed, if it
+    publishes changes
+    :param fields: The serialized fields or members, empty for all of them
+    """
+    if collection.changes is not None:
+        client.publish(collection.changes, _pack_fields(fields))
+
+
+def _changing(collection, write, fields):
+    """
+    Write to a collection, publishing the change, if it publishes changes,
+    in the same round trip
+    :param write: A function(client) to send the write
+    :param fields: As for _publish
+    :return: The write's result, None if the collection's redis is a
+        pipeline
+    """
+    redis = collection.redis
+    if collection.changes is None:
+        return write(redis)
+    if isinstance(redis, BasePipeline):
+        write(redis)
+        _publish(collection, redis, fields)
+        return None
+    pipe = redis.pipeline()
+    write(pipe)
+    _publish(collection, pipe, fields)
+    return _execute(pipe)[0]
+
+
+class _Script(object):
+    """
+    A Lua script, like redis-py's Script, but not bound to any one client, so
+    it can be shared by every collection that uses it.  The script is loaded
+    into each server the first time it runs there.
+    """
+
+    # The SHAs of the scripts known to be loaded, by connection pool
+    _loaded = weakref.WeakKeyDictionary()
+    # Every script, by SHA, to rerun the ones a server has lost
+    _by_sha = {}
+
+    def __init__(self, script):
+        self.script = script
+        self.sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        _Script._by_sha[self.sha] = self
+
+    def __call__(self, client, keys=(), args=()):
+        """
+        Run the script
+        :param client: The StrictRedis or pipeline to run it with.  A
+            pipeline should be executed with _execute, in case the server
+            has lost the script since it was loaded.
+        :param keys: The keys the script uses (KEYS in Lua)
+        :param args: Other arguments (ARGV in Lua)
+        :return: The script's result
+        """
+        args = tuple(keys) + tuple(args)
+        loaded = _Script._loaded.setdefault(client.connection_pool, set())
+        if isinstance(client, BasePipeline):
+            # Not client.scripts, which costs a SCRIPT EXISTS round trip
+            # every time the pipeline is executed
+            if self.sha not in loaded:
+                client.immediate_execute_command('SCRIPT LOAD', self.script)
+                loaded.add(self.sha)
+            return client.evalsha(self.sha, len(keys), *args)
+        try:
+            result = client.evalsha(self.sha, len(keys), *args)
+        except NoScriptError:
+            client.script_load(self.script)
+            result = client.evalsha(self.sha, len(keys), *args)
+        loaded.add(self.sha)
+        return result
+
+
+def _execute(pipe, raise_on_error=True):
+    """
+    Execute a pipeline, running again any script calls that failed because
+    the server had lost the script, e.g. to a restart.  Those run after the
+    rest of the pipeline, outside any transaction.
+    :return: The results, as from pipe.execute
+    """
+    stack = [args for args, options in pipe.command_stack]
+    results = pipe.execute(raise_on_error=False)
+    lost = [i for i, r in enumerate(results) if isinstance(r, NoScriptError)]
+    if lost:
+        _Script._loaded.pop(pipe.connection_pool, None)
+        for i in lost:
+            sha, n = stack[i][1], int(stack[i][2])
+            _Script._by_sha[sha](pipe, keys=stack[i][3:3 + n],
+                                 args=stack[i][3 + n:])
+        for i, r in zip(lost, pipe.execute(raise_on_error=False)):
+            results[i] = r
+    if raise_on_error:
+        for r in results:
+            if isinstance(r, ResponseError):
+                raise r
+    return results
+
+
+def _transaction(redis, func, *watches):
+    """Like redis.transaction, but executing with _execute"""
+    with redis.pipeline() as pipe:
+        while True:
+            try:
+                if watches:
+                    pipe.watch(*watches)
+                func(pipe)
+                return _execute(pipe)
+            except WatchError:
+                continue
+
+
+# Remove and return any one field and its value from a hash.  Writing after
+# HSCAN, a random command, needs effects replication before Redis 5.
+_HPOPITEM = _Script("""
+if redis.replicate_commands then redis.replicate_commands() end
+local cursor = '0'
+repeat
+    local page = redis.call('HSCAN', KEYS[1], cursor)
+    cursor = page[1]
+    if #page[2] > 0 then
+        redis.call('HDEL', KEYS[1], page[2][1])
+        return {page[2][1], page[2][2]}
+    end
+until tonumber(cursor) == 0
+return false
+""")
+
+
+# 1 if the hashes KEYS[1] and KEYS[2] hold the same fields and values, else 0
+_HASH_EQ = _Script("""
+if redis.call('HLEN', KEYS[1]) ~= redis.call('HLEN', KEYS[2]) then
+    return 0
+end
+local cursor = '0'
+repeat
+    local page = redis.call('HSCAN', KEYS[1], cursor, 'COUNT', 1000)
+    cursor = page[1]
+    local fields = page[2]
+    for i = 1, #fields, 2 do
+        if redis.call('HGET', KEYS[2], fields[i]) ~= fields[i + 1] then
+            return 0
+        end
+    end
+until tonumber(cursor) == 0
+return 1
+""")
+
+
+# Add to the sorted set KEYS[1] the members of the sorted set KEYS[2] at the
+# ranks ARGV[1] to ARGV[2] that are in none of KEYS[3..], with their scores.
+# Return how many members were read.  Used a page at a time, where there's
+# no ZDIFFSTORE, so the server isn't blocked for the whole difference.
+_ZDIFF_PAGE = _Script("""
+local members = redis.call('ZRANGE', KEYS[2], ARGV[1], ARGV[2], 'WITHSCORES')
+local keep = {}
+for i = 1, #members, 2 do
+    local found = false
+    for k = 3, #KEYS do
+        if redis.call('ZSCORE', KEYS[k], members[i]) then
+            found = true
+            break
+        end
+    end
+    if not found then
+        keep[#keep + 1] = members[i + 1]
+        keep[#keep + 1] = members[i]
+    end
+end
+if #keep > 0 then
+    redis.call('ZADD', KEYS[1], unpack(keep))
+    redis.call('EXPIRE', KEYS[1], 3600)
+end
+return #members / 2
+""")
+
+
+def _zdiffstore(redis, name, keys, ttl=None):
+    """
+    Store in name the members of the sorted set keys[0] that are in none of
+    the others, with their scores: ZDIFFSTORE, in one round trip, where the
+    server has it (Redis 6.2+), or else a script run a page at a time into a
+    temporary key, which isn't atomic
+    :param ttl: Seconds for name to live, None for no expiry
+    """
+    def store(write):
+        pipe = redis.pipeline(transaction=False)
+        write(pipe)
+        if ttl is not None:
+            pipe.expire(name, ttl)
+        result = _execute(pipe, raise_on_error=False)[0]
+        if isinstance(result, ResponseError):
+            raise result
+        return result
+
+    try:
+        store(lambda pipe: pipe.execute_command('ZDIFFSTORE', name,
+                                                len(keys), *keys))
+        return
+    except ResponseError as e:
+        if 'unknown command' not in str(e).lower():
+            raise
+    # Everything is read before name is written, so it may be any of keys
+    tmp = b'-=-COMBINING-=-' + _token()
+    start = 0
+    while True:
+        read = _ZDIFF_PAGE(redis, keys=[tmp] + list(keys),
+                           args=[start, start + _CHUNK_SIZE - 1])
+        start += read
+        if read < _CHUNK_SIZE:
+            break
+    if redis.exists(tmp):
+        def rename(pipe):
+            pipe.rename(tmp, name)
+            if ttl is None:
+                pipe.persist(name)  # The temporary key's TTL came too
+        store(rename)
+    else:
+        redis.delete(name)
+
+
+# Rename each of KEYS[1], KEYS[3]... that exists to the key after it, and
+# return how many were renamed
+_RENAME_EXISTING = _Script("""
+local n = 0
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+        n = n + 1
+    end
+end
+return n
+""")
+
+
+# Move a key's entry in a lex index.  KEYS[1] is the index, a sorted set of
+# value + NUL + key, KEYS[2] a hash from each key to its member there.
+# ARGV[1] is the key, ARGV[2] its new member, or empty to remove it.
+_LEX_INDEX = _Script("""
+local old = redis.call('HGET', KEYS[2], ARGV[1])
+if old then
+    redis.call('ZREM', KEYS[1], old)
+end
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], 0, ARGV[2])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+""")
+
+
+# Query an index, KEYS[1], for the keys with values from ARGV[2] to ARGV[3]
+# (ZRANGEBYLEX bounds if ARGV[1] is 1, else ZRANGEBYSCORE's), skipping the
+# first ARGV[4] and returning up to ARGV[5] (-1 for all).  Entries for keys
+# that no longer exist, e.g. that expired, are removed as they're found, from
+# the lex index's hash KEYS[2] too, and more are read to make up for them.
+_QUERY_INDEX = _Script("""
+local lex = ARGV[1] == '1'
+local skip = tonumber(ARGV[4])
+local count = tonumber(ARGV[5])
+local want = count
+if count >= 0 then
+    want = skip + count
+end
+local found = {}
+local start = 0
+while true do
+    local command = lex and 'ZRANGEBYLEX' or 'ZRANGEBYSCORE'
+    local members = redis.call(command, KEYS[1], ARGV[2], ARGV[3],
+                               'LIMIT', start, want)
+    local stale = 0
+    for _, m in ipairs(members) do
+        local key = m
+        if lex then
+            key = string.sub(m, string.find(m, '\0', 1, true) + 1)
+        end
+        if redis.call('EXISTS', key) == 1 then
+            if skip > 0 then
+                skip = skip - 1
+            else
+                found[#found + 1] = key
+            end
+        else
+            redis.call('ZREM', KEYS[1], m)
+            if lex then
+                redis.call('HDEL', KEYS[2], key)
+            end
+            stale = stale + 1
+        end
+    end
+    if want < 0 or stale == 0 or #members < want then
+        return found
+    end
+    start = start + #members - stale
+    want = stale
+end
+""")
+
+# The next page of a score range of the sorted set KEYS[1]: up to ARGV[3]
+# members, with their scores, after the member ARGV[1], whose score was
+# ARGV[2], highest first if ARGV[4] is 1.  The page starts from the member's
+# rank, so members sharing a score needn't be skipped one by one, unless
+# its score has changed, when it starts after the old score instead.
+_SCORE_PAGE = _Script("""
+local rev = ARGV[4] == '1'
+local n = tonumber(ARGV[3])
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) == ARGV[2] then
+    local rank = redis.call(rev and 'ZREVRANK' or 'ZRANK', KEYS[1], ARGV[1])
+    return redis.call(rev and 'ZREVRANGE' or 'ZRANGE', KEYS[1], rank + 1,
+                      rank + n, 'WITHSCORES')
+end
+if rev then
+    return redis.call('ZREVRANGEBYSCORE', KEYS[1], '(' .. ARGV[2], '-inf',
+                      'WITHSCORES', 'LIMIT', 0, n)
+end
+return redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. ARGV[2], '+inf',
+                  'WITHSCORES', 'LIMIT', 0, n)
+""")
+
+
+def _score_bound(bound):
+    """:return: (score, True if exclusive) for a ZRANGEBYSCORE bound"""
+    bound = bound.decode('utf-8') if isinstance(bound, bytes) \
+        else str(bound)
+    if bound.startswith('('):
+        return float(bound[1:]), True
+    return float(bound), False
+
+
+def _peer(a, b, cls, *serializers):
+    """
+    :param a: A collection
+    :param b: Another object
+    :param cls: The class b must be for the two to work together on the
+        server
+    :param serializers: The names of the serializer attributes that must match
+    :return: True if b is a cls in the same database as a, serializing its
+        contents the same way, so the two can be combined or compared by
+        commands on the server
+    """
+    return isinstance(b, cls) and \
+        all(getattr(a, s) is getattr(b, s) for s in serializers) and \
+        _same_db(a.redis, b.redis)
+
+
+def _same_db(a, b):
+    """
+    :param a: one StrictRedis (or pipeline)
+    :param b: another StrictRedis (or pipeline)
+    :return: True if both talk to the same database on the same server, so
+        commands may combine keys from collections using either one
+    """
+    if a is b:
+        return True
+    ka = a.connection_pool.connection_kwargs
+    kb = b.connection_pool.connection_kwargs
+    return all(ka.get(k) == kb.get(k) for k in ('host', 'port', 'path', 'db'))
+
+
 def _dict_eq(a, b):
     """
     Compare dictionaries using their items iterators and loading as much
@@ -324,7 +1138,9 @@ class RedisList(MutableSequence):
     Operations on the ends of the list, and len() are O(1).
     Operations on elements by index are O(N)."""
 
-    def __init__(self, name, redis=StrictRedis(), serializer=pickle):
+    __slots__ = ('name', 'redis', 'serializer', '__weakref__')
+
+    def __init__(self, name, redis=None, serializer=pickle):
         """
 
         :param name: The key for this entry in Redis
@@ -334,7 +1150,7 @@ class RedisList(MutableSequence):
              "loads" to turn a byte array into an object.  Default = pickle
         """
         self.name = name
-        self.redis = redis
+        self.redis = redis if redis is not None else _default_redis()
         self.serializer = serializer
 
     def __getitem__(self, index):
@@ -397,6 +1213,17 @@ class RedisList(MutableSequence):
         self.redis.rpush(self.name,
                          *[self.serializer.dumps(v) for v in values])
 
+    def tail(self, n):
+        """
+        O(n)
+        :param n: The number of items to fetch
+        :return: A list of the last n items, oldest first
+        """
+        if n <= 0:
+            return []
+        return [self.serializer.loads(x)
+                for x in self.redis.lrange(self.name, -n, -1)]
+
     def clear(self):
         self.redis.delete(self.name)
 
@@ -473,12 +1300,56 @@ class RedisList(MutableSequence):
         return _repr(self)
 
 
+class RedisCappedList(RedisList):
+    """A RedisList holding at most maxlen items, like a collections.deque
+    with maxlen.  Appending to a full list discards items from the front.
+    Each append or extend is a single round trip, pushing and trimming in one
+    transaction, so the list never grows past maxlen."""
+
+    __slots__ = ('maxlen',)
+
+    def __init__(self, name, maxlen, redis=None, serializer=pickle):
+        """
+
+        :param name: The key for this entry in Redis
+        :param maxlen: The most items to keep
+        :param redis: The StrictRedis connection to use
+        :param serializer: An object containing functions "dumps" to turn an
+             object (to store) into a byte array, and
+             "loads" to turn a byte array into an object.  Default = pickle
+        """
+        if maxlen < 1:
+            raise ValueError("maxlen must be positive")
+        super(RedisCappedList, self).__init__(name, redis, serializer)
+        self.maxlen = maxlen
+
+    def __push(self, values):
+        if len(values):
+            self.redis.pipeline().rpush(self.name, *values). \
+                ltrim(self.name, -self.maxlen, -1).execute()
+
+    def append(self, value):
+        self.__push([self.serializer.dumps(value)])
+
+    def extend(self, values):
+        # Only the last maxlen values can survive the trim, so there's no
+        # sense serializing or sending the rest.
+        self.__push([self.serializer.dumps(v)
+                     for v in list(values)[-self.maxlen:]])
+
+    def insert(self, index, value):
+        super(RedisCappedList, self).insert(index, value)
+        self.redis.ltrim(self.name, -self.maxlen, -1)
+
+
 class RedisSet(MutableSet):
     """
     A set, backed by the Redis set construct.
     """
 
-    def __init__(self, name, redis=StrictRedis(), serializer=pickle):
+    __slots__ = ('name', 'redis', 'serializer', '__weakref__')
+
+    def __init__(self, name, redis=None, serializer=pickle):
         """
 
         :param name: The key for this entry in Redis
@@ -488,7 +1359,7 @@ class RedisSet(MutableSet):
              "loads" to turn a byte array into an object.  Default = pickle
         """
         self.name = name
-        self.redis = redis
+        self.redis = redis if redis is not None else _default_redis()
         self.serializer = serializer
 
     def __iter__(self):
@@ -501,17 +1372,299 @@ class RedisSet(MutableSet):
     def __contains__(self, item):
         return self.redis.sismember(self.name, self.serializer.dumps(item))
 
+    def contains_many(self, items):
+        """
+        Test many items for membership in one round trip.  O(M)
+
+        :param items: The items to look for
+        :return: A list of booleans, True where the corresponding item is in
+            the set
+        """
+        items = [self.serializer.dumps(item) for item in items]
+        if not len(items):
+            return []
+        try:
+            found = self.redis.execute_command('SMISMEMBER', self.name,
+                                               *items)
+        except ResponseError:  # Redis before 6.2
+            pipe = self.redis.pipeline(transaction=False)
+            for item in items:
+                pipe.sismember(self.name, item)
+            found = pipe.execute()
+        return [bool(f) for f in found]
+
+    def pop(self):
+        """
+        Remove and return an arbitrary item.  O(1)
+        :raises KeyError if the set is empty
+        """
+        rval = self.redis.spop(self.name)
+        if rval is None:
+            raise KeyError('pop from an empty set')
+        return self.serializer.loads(rval)
+
+    def pop_many(self, n):
+        """
+        Remove and return up to n arbitrary items in one round trip.  O(n)
+        :return: A list of the items removed, shorter than n if the set ran
+            out
+        """
+        if n <= 0:
+            return []
+        try:
+            items = self.redis.execute_command('SPOP', self.name, n)
+        except ResponseError:  # Redis before 3.2
+            pipe = self.redis.pipeline()
+            for _ in range(n):
+                pipe.spop(self.name)
+            items = [x for x in pipe.execute() if x is not None]
+        return [self.serializer.loads(item) for item in items]
+
+    def sample(self, n):
+        """
+        Return up to n distinct arbitrary items, without removing them.  O(n)
+        :param n: How many items to return.  If negative, -n items are
+            returned and may repeat, as with SRANDMEMBER.
+        :return: A list of the items
+        """
+        if n == 0:
+            return []
+        return [self.serializer.loads(item)
+                for item in self.redis.srandmember(self.name, n)]
+
+    @classmethod
+    def _from_iterable(cls, it):
+        """Results of set operations that can't be done on the server are
+        ordinary, in-memory sets."""
+        return set(it)
+
+    def _peers(self, others):
+        """
+        :param others: some iterables
+        :return: the names of the others, if they are all RedisSets in the
+            same database and with the same serializer as this one, so they
+            can be combined with it on the server, None otherwise
+        """
+        names = []
+        for other in others:
+            if not _peer(self, other, RedisSet, 'serializer'):
+                return None
+            names.append(other.name)
+        return names
+
+    def __loads_all(self, items):
+        return set(self.serializer.loads(item) for item in items)
+
+    def __measure(self, store, other):
+        """
+        Measure this set, another one in the same database, and the result
+        of combining them, without transferring any members.  O(N)
+
+        :param store: The name of the pipeline method to combine them with,
+            sinterstore or sdiffstore
+        :param other: Another RedisSet
+        :return: len(self), len(other), len(the combination)
+        """
+        tmp = b'-=-MEASURING-=-' + _token()
+        pipe = self.redis.pipeline()
+        pipe.scard(self.name)
+        pipe.scard(other.name)
+        getattr(pipe, store)(tmp, self.name, other.name)
+        pipe.delete(tmp)
+        return tuple(pipe.execute()[:3])
+
+    def intersection(self, *others):
+        """
+        :return: A set of the items in this and all the others, computed
+            on the server if the others are RedisSets alongside this one
+        """
+        names = self._peers(others)
+        if names is None:
+            return set(self).intersection(*others)
+        return self.__loads_all(self.redis.sinter(self.name, *names))
+
+    def union(self, *others):
+        """
+        :return: A set of the items in this or any of the others, computed
+            on the server if the others are RedisSets alongside this one
+        """
+        names = self._peers(others)
+        if names is None:
+            return set(self).union(*others)
+        return self.__loads_all(self.redis.sunion(self.name, *names))
+
+    def difference(self, *others):
+        """
+        :return: A set of the items in this and none of the others, computed
+            on the server if the others are RedisSets alongside this one
+        """
+        names = self._peers(others)
+        if names is None:
+            return set(self).difference(*others)
+        return self.__loads_all(self.redis.sdiff(self.name, *names))
+
+    def symmetric_difference(self, other):
+        """
+        :return: A set of the items in exactly one of this and the other,
+            computed on the server if the other is a RedisSet alongside this
+        """
+        if self._peers((other,)) is None:
+            return set(self).symmetric_difference(other)
+        pipe = self.redis.pipeline()
+        pipe.sdiff(self.name, other.name)
+        pipe.sdiff(other.name, self.name)
+        mine, theirs = pipe.execute()
+        return self.__loads_all(mine | theirs)
+
+    def __store(self, store, name, others, combine):
+        names = self._peers(others)
+        rs = RedisSet(name, self.redis, self.serializer)
+        if names is None:
+            new_data = combine(*others)
+            rs.clear()
+            rs.update(new_data)
+        else:
+            getattr(self.redis, store)(name, self.name, *names)
+        return rs
+
+    def intersection_store(self, name, *others):
+        """
+        Store the intersection of this set and the others in Redis, without
+        transferring it to the client if the others are RedisSets alongside
+        this one.
+        :param name: The key for the result, replaced if it exists
+        :return: A RedisSet of the result
+        """
+        return self.__store('sinterstore', name, others, self.intersection)
+
+    def union_store(self, name, *others):
+        """
+        Like intersection_store, but for the union
+        """
+        return self.__store('sunionstore', name, others, self.union)
+
+    def difference_store(self, name, *others):
+        """
+        Like intersection_store, but for the difference
+        """
+        return self.__store('sdiffstore', name, others, self.difference)
+
+    def __and__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__and__(self, other)
+        return self.intersection(other)
+
+    def __or__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__or__(self, other)
+        return self.union(other)
+
+    def __sub__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__sub__(self, other)
+        return self.difference(other)
+
+    def __xor__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__xor__(self, other)
+        return self.symmetric_difference(other)
+
+    def intersection_update(self, *others):
+        names = self._peers(others)
+        if names is None:
+            for other in others:
+                MutableSet.__iand__(self, other)
+        else:
+            self.redis.sinterstore(self.name, self.name, *names)
+
+    def difference_update(self, *others):
+        names = self._peers(others)
+        if names is None:
+            for other in others:
+                MutableSet.__isub__(self, other)
+        elif len(names):
+            self.redis.sdiffstore(self.name, self.name, *names)
+
+    def symmetric_difference_update(self, other):
+        if self._peers((other,)) is None:
+            MutableSet.__ixor__(self, other)
+        else:
+            tmp = b'-=-XOR-=-' + _token()
+            self.redis.pipeline(). \
+                sdiffstore(tmp, other.name, self.name). \
+                sdiffstore(self.name, self.name, other.name). \
+                sunionstore(self.name, self.name, tmp). \
+                delete(tmp).execute()
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def __eq__(self, other):
+        """
+        Comparison to another RedisSet in the same database is done on the
+        server, transferring no members.  Comparison to other sets takes
+        time O(N).
+        """
+        if self._peers((other,)) is None:
+            return MutableSet.__eq__(self, other)
+        mine, theirs, extra = self.__measure('sdiffstore', other)
+        return mine == theirs and extra == 0
+
+    def isdisjoint(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.isdisjoint(self, other)
+        return self.__measure('sinterstore', other)[2] == 0
+
+    def __le__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__le__(self, other)
+        return self.__measure('sdiffstore', other)[2] == 0
+
+    def __lt__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__lt__(self, other)
+        mine, theirs, extra = self.__measure('sdiffstore', other)
+        return mine < theirs and extra == 0
+
+    def __ge__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__ge__(self, other)
+        return other.__le__(self)
+
+    def __gt__(self, other):
+        if self._peers((other,)) is None:
+            return MutableSet.__gt__(self, other)
+        return other.__lt__(self)
+
     def update(self, *others):
+        names = self._peers(others)
+        if names:
+            self.redis.sunionstore(self.name, self.name, *names)
+            return
         # The call to __hash__ for each item insures it's hashable (i.e.
         # unmodifiable), and thus suitable for a set.
         # These sets are persisted and unmodifiable once they're saved, but
         # I haven't thought of a good reason to change the basic contract
         # for set - because this set will also be transformed into an
         # in-memory set in some cases.
-        new_data = [(item.__hash__() or True) and self.serializer.dumps(item)
-                    for sublist in others for item in sublist]
-        if len(new_data):
-            self.redis.sadd(self.name, *new_data)
+        new_data = ((item.__hash__() or True) and self.serializer.dumps(item)
+                    for sublist in others for item in sublist)
+        _write_chunks(self.redis,
+                      lambda client, chunk: client.sadd(self.name, *chunk),
+                      _chunked(new_data))
 
     def add(self, item):
         """
@@ -535,8 +1688,11 @@ class RedisDict(MutableMapping):
     A dictionary, backed by Redis
     """
 
-    def __init__(self, name, redis=StrictRedis(), serializer=pickle,
-                 key_serializer=pickle):
+    __slots__ = ('name', 'redis', 'serializer', 'key_serializer',
+                 'changes', '__weakref__')
+
+    def __init__(self, name, redis=None, serializer=pickle,
+                 key_serializer=pickle, publish_changes=False):
         """
 
         :param name: The key for this entry in Redis
@@ -545,11 +1701,15 @@ class RedisDict(MutableMapping):
              object (to store) into a byte array, and
              "loads" to turn a byte array into an object.  Default = pickle
         :param key_serializer: Like serializer, but applied to keys
+        :param publish_changes: True to publish the fields each write
+             changes, on the channel name + ':changes', in the same round
+             trip, for a RedisMirror to follow
         """
         self.name = name
-        self.redis = redis
+        self.redis = redis if redis is not None else _default_redis()
         self.serializer = serializer
         self.key_serializer = key_serializer
+        self.changes = _changes_channel(name) if publish_changes else None
 
     def __getitem__(self, item):
         val = self.redis.hget(self.name, self.key_serializer.dumps(item))
@@ -557,13 +1717,96 @@ class RedisDict(MutableMapping):
             raise KeyError()
         return self.serializer.loads(val)
 
+    def __contains__(self, item):
+        """O(1), without transferring the value"""
+        return self.redis.hexists(self.name, self.key_serializer.dumps(item))
+
+    def get(self, item, default=None):
+        val = self.redis.hget(self.name, self.key_serializer.dumps(item))
+        if val is None:
+            return default
+        return self.serializer.loads(val)
+
+    def get_many(self, items, default=None):
+        """
+        Get the values of many keys in one round trip.  O(M)
+
+        :param items: The keys to look up
+        :param default: The value for keys that aren't in the dict
+        :return: A list of the values, in the same order as the keys
+        """
+        items = [self.key_serializer.dumps(item) for item in items]
+        if not len(items):
+            return []
+        return [default if val is None else self.serializer.loads(val)
+                for val in self.redis.hmget(self.name, items)]
+
+    def pop(self, item, default=_NOT_GIVEN):
+        """
+        Remove a key and return its value, atomically and in one round trip
+        :raises KeyError if the key is missing and no default is given
+        """
+        bkey = self.key_serializer.dumps(item)
+        pipe = self.redis.pipeline().hget(self.name, bkey). \
+            hdel(self.name, bkey)
+        _publish(self, pipe, [bkey])
+        val = pipe.execute()[0]
+        if val is None:
+            if default is _NOT_GIVEN:
+                raise KeyError(str(item))
+            return default
+        return self.serializer.loads(val)
+
+    def popitem(self):
+        """
+        Remove and return an arbitrary (key, value) pair, atomically
+        :raises KeyError if the dict is empty
+        """
+        rval = _HPOPITEM(self.redis, keys=[self.name])
+        if not rval:
+            raise KeyError('popitem(): dictionary is empty')
+        _publish(self, self.redis, [rval[0]])
+        return self.key_serializer.loads(rval[0]), \
+            self.serializer.loads(rval[1])
+
+    def setdefault(self, item, default=None):
+        """
+        Set the key to default if it's missing, atomically and in one round
+        trip
+        :return: The value of the key
+        """
+        item.__hash__()  # raise a TypeError if it isn't immutable
+        bkey = self.key_serializer.dumps(item)
+        pipe = self.redis.pipeline(). \
+            hsetnx(self.name, bkey, self.serializer.dumps(default)). \
+            hget(self.name, bkey)
+        _publish(self, pipe, [bkey])
+        val = pipe.execute()[1]
+        return self.serializer.loads(val)
+
+    def update(*args, **kwds):
+        """Set many keys with one command"""
+        new_stuff = {}
+        self = args[0]
+        args = args[1:]
+        new_stuff.update(*args, **kwds)
+        if len(new_stuff):
+            mapping = dict(
+                (self.key_serializer.dumps(k), self.serializer.dumps(v))
+                for k, v in iteritems(new_stuff))
+            _changing(self, lambda client: client.hmset(self.name, mapping),
+                      list(mapping))
+
     def __setitem__(self, item, value):
         item.__hash__()  # raise a TypeError if it isn't immutable
-        self.redis.hset(self.name, self.key_serializer.dumps(item),
-                        self.serializer.dumps(value))
+        field = self.key_serializer.dumps(item)
+        _changing(self, lambda client: client.hset(
+            self.name, field, self.serializer.dumps(value)), [field])
 
     def __delitem__(self, item):
-        if not self.redis.hdel(self.name, self.key_serializer.dumps(item)):
+        field = self.key_serializer.dumps(item)
+        if not _changing(self, lambda client: client.hdel(self.name, field),
+                         [field]):
             raise KeyError()
 
     def __iter__(self):
@@ -574,7 +1817,7 @@ class RedisDict(MutableMapping):
         return self.redis.hlen(self.name)
 
     def clear(self):
-        self.redis.delete(self.name)
+        _changing(self, lambda client: client.delete(self.name), [])
 
     def __repr__(self):
         return _repr(self, '{%s}')
@@ -586,21 +1829,247 @@ class RedisDict(MutableMapping):
     def iteritems(self):
         return self.items()
 
+    def values(self):
+        for k, v in self.redis.hscan_iter(self.name):
+            yield self.serializer.loads(v)
+
+    def itervalues(self):
+        return self.values()
+
     def __eq__(self, other):
         """
+        Comparison to another RedisDict in the same database is done by a
+        script on the server, returning only the verdict.  Entries match there
+        if their serialized keys and values are identical.  Comparison to
+        other dicts takes memory and time O(N).
+
         :return contents equal to the other dict
         """
+        if _peer(self, other, RedisDict, 'serializer', 'key_serializer'):
+            return bool(_HASH_EQ(self.redis, keys=[self.name, other.name]))
         return _dict_eq(self, other)
 
 
+class _Numbers(object):
+    """
+    A serializer storing numbers as Redis does, so HINCRBY and HINCRBYFLOAT
+    can add to them
+    """
+
+    @staticmethod
+    def dumps(n):
+        return (('%r' if isinstance(n, float) else '%d') % n).encode('utf-8')
+
+    @staticmethod
+    def loads(b):
+        try:
+            return int(b)
+        except ValueError:
+            return float(b)
+
+
+class RedisCounter(RedisDict):
+    """
+    A collections.Counter, backed by a Redis hash.  Counts are stored as
+    numbers, so adding to one is a single atomic HINCRBY (or HINCRBYFLOAT, for
+    fractions) rather than a read-modify-write.
+
+    Given a flush_interval, increments are added up locally instead, and sent
+    in one pipeline no more than flush_interval seconds later, so frequent
+    increments to the same keys cost one round trip between them.  Reads see
+    only the counts that have been flushed; call flush() before reading or
+    exiting to send the rest.
+    """
+
+    __slots__ = ('flush_interval', '__pending', '__lock', '__timer')
+
+    def __init__(self, name, redis=None, key_serializer=pickle,
+                 flush_interval=None, publish_changes=False):
+        """
+
+        :param name: The key for this entry in Redis
+        :param redis: The StrictRedis connection to use
+        :param key_serializer: An object containing functions "dumps" to turn
+             a key into a byte array, and "loads" to turn a byte array into a
+             key.  Default = pickle
+        :param flush_interval: The most time, in seconds, to hold increments
+            locally, default is None - send each one immediately
+        :param publish_changes: As for RedisDict
+        """
+        super(RedisCounter, self).__init__(name, redis, _Numbers,
+                                           key_serializer, publish_changes)
+        self.flush_interval = flush_interval
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__timer = None
+
+    def __getitem__(self, item):
+        """:return: The count for item, 0 if it's missing"""
+        val = self.redis.hget(self.name, self.key_serializer.dumps(item))
+        if val is None:
+            return 0
+        return _Numbers.loads(val)
+
+    def __delitem__(self, item):
+        """Like Counter, deleting a missing item is not an error"""
+        field = self.key_serializer.dumps(item)
+        _changing(self, lambda client: client.hdel(self.name, field),
+                  [field])
+
+    def __add_all(self, deltas):
+        """
+        Add to the counts, now or in the next flush
+        :param deltas: A dict of serialized key to the amount to add
+        """
+        if self.flush_interval is None:
+            _hincr_all(self, deltas)
+            return
+        with self.__lock:
+            self.__buffer(deltas)
+
+    def __buffer(self, deltas):
+        """Add deltas to the pending increments.  Hold the lock."""
+        for field, delta in iteritems(deltas):
+            self.__pending[field] = self.__pending.get(field, 0) + delta
+        if self.__timer is None and self.__pending:
+            self.__timer = threading.Timer(self.flush_interval, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def increment(self, item, delta=1):
+        """
+        Add to the count for an item
+        :return: The new count, or None if the increment was buffered
+        """
+        item.__hash__()  # raise a TypeError if it isn't immutable
+        field = self.key_serializer.dumps(item)
+        if self.flush_interval is not None:
+            self.__add_all({field: delta})
+            return None
+        if not isinstance(delta, float):
+            try:
+                return _changing(self, lambda client: client.hincrby(
+                    self.name, field, delta), [field])
+            except ResponseError:  # The count is fractional
+                pass
+        return _changing(self, lambda client: client.hincrbyfloat(
+            self.name, field, delta), [field])
+
+    def __deltas(self, args, kwds, sign):
+        if len(args) > 1:
+            raise TypeError('expected at most 1 argument, got %d' % len(args))
+        deltas = {}
+
+        def add(item, delta):
+            item.__hash__()  # raise a TypeError if it isn't immutable
+            field = self.key_serializer.dumps(item)
+            deltas[field] = deltas.get(field, 0) + sign * delta
+
+        for arg in args:
+            if isinstance(arg, Mapping):
+                for item, delta in iteritems(arg):
+                    add(item, delta)
+            else:
+                for item in arg:
+                    add(item, 1)
+        for item, delta in iteritems(kwds):
+            add(item, delta)
+        return deltas
+
+    def update(*args, **kwds):
+        """
+        Like Counter.update, add counts from an iterable of items or a
+        mapping of items to counts.  All the increments are sent in one
+        pipeline.
+        """
+        self = args[0]
+        self.__add_all(self.__deltas(args[1:], kwds, 1))
+
+    def subtract(*args, **kwds):
+        """Like update, but subtract the counts"""
+        self = args[0]
+        self.__add_all(self.__deltas(args[1:], kwds, -1))
+
+    def flush(self):
+        """
+        Send any buffered increments to Redis, in one pipeline.  If that
+        fails, the increments not sent are buffered again, to be sent by
+        the next flush.
+        """
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+        try:
+            _hincr_all(self, pending)
+        except Exception:
+            with self.__lock:
+                self.__buffer(pending)
+            raise
+
+    def most_common(self, n=None):
+        """
+        :return: A list of the n most common items and their counts, from the
+            most common to the least, all the items if n is None.  O(N)
+        """
+        if n is None:
+            return sorted(self.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.items(), key=itemgetter(1))
+
+    def elements(self):
+        """Iterate over the items, each repeated as many times as its count"""
+        for item, count in self.items():
+            for _ in range(count):
+                yield item
+
+
+def _hincr_all(counter, deltas):
+    """
+    Add to many fields of a counter's hash in one pipeline.  Integers that
+    can't be added with HINCRBY, because the field holds a fraction, are
+    added with HINCRBYFLOAT in a second one.
+    :param deltas: A dict of field to the amount to add.  Each is removed
+        once it's added, so those left after an error weren't.
+    """
+    if not len(deltas):
+        return
+    name = counter.name
+    fields = list(deltas)
+    pipe = counter.redis.pipeline(transaction=False)
+    for field in fields:
+        delta = deltas[field]
+        if isinstance(delta, float):
+            pipe.hincrbyfloat(name, field, delta)
+        else:
+            pipe.hincrby(name, field, delta)
+    for field, result in zip(fields, pipe.execute(raise_on_error=False)):
+        if isinstance(result, ResponseError):
+            pipe.hincrbyfloat(name, field, deltas[field])
+        else:
+            del deltas[field]
+    _publish(counter, pipe, fields)
+    pipe.execute()
+    deltas.clear()
+
+
 class RedisSortedSet(MutableMapping):
     """
     A Redis sorted set wrapped as a dict.  Entries are stored in the dictionary
     keys, scores are their values. Items are sorted in order by their values.
     Values must be floating point numbers.
+
+    Iteration and range queries stream their results, page_size members per
+    round trip, default_page_size unless it's set on the instance.
     """
 
-    def __init__(self, name, redis=StrictRedis(), serializer=pickle):
+    __slots__ = ('name', 'redis', 'serializer', 'page_size', 'changes',
+                 '__weakref__')
+
+    default_page_size = 1000
+
+    def __init__(self, name, redis=None, serializer=pickle,
+                 publish_changes=False):
         """
 
         :param name: The name of this set in Redis
@@ -608,19 +2077,69 @@ class RedisSortedSet(MutableMapping):
         :param serializer: An object containing functions "dumps" to turn an
              object (to store) into a byte array, and
              "loads" to turn a byte array into an object.  Default = pickle
+        :param publish_changes: True to publish the members each write
+             changes, as RedisDict does
         """
         self.name = name
-        self.redis = redis
+        self.redis = redis if redis is not None else _default_redis()
         self.serializer = serializer
+        self.page_size = self.default_page_size
+        self.changes = _changes_channel(name) if publish_changes else None
 
     def __contains__(self, item):
         """Test to see if a key is in the set. O(1)"""
         return self.redis.zscore(self.name, self.serializer.dumps(item)) \
             is not None
 
-    def items(self):
-        """Return a generator over the keys and their sort values"""
-        for k, v in self.redis.zscan_iter(self.name):
+    def __paged(self, fetch, offset=0, count=None):
+        """
+        Stream the results of a query by rank, a page at a time
+        :param fetch: A function(offset, num) to get one page of the range
+        :param offset: The number of results to skip
+        :param count: The most results to return, None for all of them
+        """
+        while count is None or count > 0:
+            num = self.page_size if count is None \
+                else min(count, self.page_size)
+            page = fetch(offset, num)
+            for x in page:
+                yield x
+            if len(page) < num:
+                return
+            offset += num
+            if count is not None:
+                count -= num
+
+    def __keyset(self, first, after, count=None):
+        """
+        Stream the results of a range query, a page at a time, each page
+        starting after the last result of the one before, so the server
+        needn't walk past the earlier pages again
+        :param first: A function(num) to get the first page
+        :param after: A function(last result, num) to get the next page
+        :param count: The most results to return, None for all of them
+        """
+        page = None
+        while count is None or count > 0:
+            num = self.page_size if count is None \
+                else min(count, self.page_size)
+            page = first(num) if page is None else after(page[-1], num)
+            for x in page:
+                yield x
+            if len(page) < num:
+                return
+            if count is not None:
+                count -= num
+
+    def __by_rank(self, reverse, withscores):
+        return self.__paged(lambda start, num: self.redis.zrange(
+            self.name, start, start + num - 1, desc=reverse,
+            withscores=withscores))
+
+    def items(self, reverse=False):
+        """Return a generator over the keys and their sort values, in order.
+        O(N)"""
+        for k, v in self.__by_rank(reverse, True):
             yield self.serializer.loads(k), v
 
     def iteritems(self):
@@ -628,15 +2147,129 @@ class RedisSortedSet(MutableMapping):
 
     def __iter__(self):
         """Iterate over the keys, in order. O(N)"""
-        for k, v in self.redis.zscan_iter(self.name):
+        for k in self.__by_rank(False, False):
+            yield self.serializer.loads(k)
+
+    def __reversed__(self):
+        """Iterate over the keys, highest score first. O(N)"""
+        for k in self.__by_rank(True, False):
             yield self.serializer.loads(k)
 
     def __len__(self):
         """Get the size of the set. O(1)"""
         return self.redis.zcard(self.name)
 
+    def __slice(self, index):
+        """
+        O(log N + M)
+        :return: A list of the keys at the ranks in the slice
+        """
+        if index.step not in (None, 1):
+            return list(self)[index]
+        start = index.start or 0
+        if index.stop == 0:
+            return []
+        end = -1 if index.stop is None else index.stop - 1
+        return [self.serializer.loads(k)
+                for k in self.redis.zrange(self.name, start, end)]
+
+    def score_range(self, min='-inf', max='+inf', reverse=False, offset=0,
+                    count=None, withscores=False):
+        """
+        Stream the keys with scores between min and max, in order.
+        O(log N + offset) for the first page, O(log N + page_size) for each
+        one after.  A key whose score changes meanwhile may be skipped or
+        returned twice, and if the last key of a page changes, the keys
+        sharing its old score may be skipped.
+        :param min: The lowest score, prefixed with '(' to exclude it, as in
+            ZRANGEBYSCORE
+        :param max: The highest score, likewise
+        :param reverse: True to go from the highest score to the lowest
+        :param offset: The number of keys in the range to skip
+        :param count: The most keys to return, None for all of them
+        :param withscores: True to generate (key, score) pairs
+        """
+        # Scores are kept as Redis formats them, to find the last key again
+        if reverse:
+            def first(num):
+                return self.redis.zrevrangebyscore(
+                    self.name, max, min, start=offset, num=num,
+                    withscores=True, score_cast_func=bytes)
+            limit, exclusive = _score_bound(min)
+
+            def within(score):
+                return score > limit or (score == limit and not exclusive)
+        else:
+            def first(num):
+                return self.redis.zrangebyscore(
+                    self.name, min, max, start=offset, num=num,
+                    withscores=True, score_cast_func=bytes)
+            limit, exclusive = _score_bound(max)
+
+            def within(score):
+                return score < limit or (score == limit and not exclusive)
+
+        def after(last, num):
+            flat = _SCORE_PAGE(self.redis, keys=[self.name],
+                               args=[last[0], last[1], num, int(reverse)])
+            page = []
+            # Ranks run on past the end of the range
+            for k, score in zip(flat[::2], flat[1::2]):
+                if not within(float(score)):
+                    break
+                page.append((k, score))
+            return page
+
+        for k, score in self.__keyset(first, after, count):
+            if withscores:
+                yield self.serializer.loads(k), float(score)
+            else:
+                yield self.serializer.loads(k)
+
+    def lex_range(self, min=None, max=None, reverse=False, offset=0,
+                  count=None, include_min=True, include_max=True):
+        """
+        Stream the keys between min and max, in the order of their serialized
+        bytes, as in ZRANGEBYLEX.  This is meaningful when all the scores are
+        equal and the serializer preserves order (as UTF-8 does for strings,
+        but pickle does not).  O(log N + offset) for the first page,
+        O(log N + page_size) for each one after.
+        :param min: The lowest key, None for no limit
+        :param max: The highest key, None for no limit
+        :param reverse: True to go from the highest key to the lowest
+        :param offset: The number of keys in the range to skip
+        :param count: The most keys to return, None for all of them
+        :param include_min: False to leave out the key equal to min
+        :param include_max: False to leave out the key equal to max
+        """
+        bmin = b'-' if min is None else \
+            (b'[' if include_min else b'(') + self.serializer.dumps(min)
+        bmax = b'+' if max is None else \
+            (b'[' if include_max else b'(') + self.serializer.dumps(max)
+        if reverse:
+            def first(num):
+                return self.redis.zrevrangebylex(self.name, bmax, bmin,
+                                                 start=offset, num=num)
+
+            def after(last, num):
+                return self.redis.zrevrangebylex(self.name, b'(' + last,
+                                                 bmin, start=0, num=num)
+        else:
+            def first(num):
+                return self.redis.zrangebylex(self.name, bmin, bmax,
+                                              start=offset, num=num)
+
+            def after(last, num):
+                return self.redis.zrangebylex(self.name, b'(' + last, bmax,
+                                              start=0, num=num)
+        for k in self.__keyset(first, after, count):
+            yield self.serializer.loads(k)
+
     def __getitem__(self, key):
-        """Get the score of an item in the set. O(log N)"""
+        """Get the score of an item in the set. O(log N)
+        Given a slice, get a list of the keys at those ranks instead."""
+        if isinstance(key, slice):
+            return self.__slice(key)
         rval = self.redis.zscore(self.name, self.serializer.dumps(key))
         if rval is None:
             raise KeyError(str(key))
@@ -645,14 +2278,33 @@ class RedisSortedSet(MutableMapping):
     def __setitem__(self, key, value):
         """Put an item in the set. O(log N)"""
         key.__hash__()  # See that it's hashable, otherwise it's not a key
-        self.redis.zadd(self.name, value + 0.0, self.serializer.dumps(key))
+        member = self.serializer.dumps(key)
+        score = value + 0.0
+        _changing(self, lambda client: client.zadd(self.name, score, member),
+                  [member])
 
     def __eq__(self, other):
         """
-        Comparison to another RedisSortedSet is memory-efficient.  Comparison
-        to other dictionaries takes memory and time O(N).
+        Comparison to another RedisSortedSet in the same database is done on
+        the server, transferring no members: the difference of their scores
+        is stored temporarily, and must have as many members as each set,
+        all of them zero.  Comparison to other dictionaries takes memory and
+        time O(N).
         """
-        return _dict_eq(self, other)
+        if not _peer(self, other, RedisSortedSet, 'serializer'):
+            return _dict_eq(self, other)
+        if self.name == other.name:
+            return True
+        tmp = b'-=-COMPARING-=-' + _token()
+        pipe = self.redis.pipeline()
+        pipe.zcard(self.name)
+        pipe.zcard(other.name)
+        pipe.zunionstore(tmp, {self.name: 1, other.name: -1})
+        pipe.zcount(tmp, '-inf', '(0')
+        pipe.zcount(tmp, '(0', '+inf')
+        pipe.delete(tmp)
+        mine, theirs, both, below, above, _ = pipe.execute()
+        return mine == theirs == both and below == above == 0
 
     def index(self, value):
         """Return the rank of the value (its ordinal position in the set).
@@ -665,22 +2317,349 @@ class RedisSortedSet(MutableMapping):
         else:
             raise ValueError()
 
+    def rank_with_score(self, value, reverse=False):
+        """
+        Get the rank and score of a value in one round trip.  O(log N)
+        :param reverse: True to rank from the highest score, 0, down
+        :return: A tuple of the rank and the score
+        :raises ValueError if the value isn't in the set
+        """
+        bval = self.serializer.dumps(value)
+        pipe = self.redis.pipeline()
+        if reverse:
+            pipe.zrevrank(self.name, bval)
+        else:
+            pipe.zrank(self.name, bval)
+        rank, score = pipe.zscore(self.name, bval).execute()
+        if rank is None:
+            raise ValueError()
+        return rank, score
+
+    def increment(self, key, delta=1):
+        """
+        Add to the score of a key atomically, adding the key with a score of
+        delta if it's missing.  O(log N)
+        :return: The new score
+        """
+        key.__hash__()  # See that it's hashable, otherwise it's not a key
+        member = self.serializer.dumps(key)
+        return _changing(self, lambda client: client.zincrby(
+            self.name, member, delta), [member])
+
+    def increment_many(self, deltas):
+        """
+        Add to the scores of many keys in one round trip.  O(M log N)
+        :param deltas: A dict of keys to the amounts to add to their scores
+        :return: A dict of the keys to their new scores
+        """
+        keys = list(deltas)
+        members = []
+        pipe = self.redis.pipeline()
+        for key in keys:
+            key.__hash__()  # See that it's hashable, otherwise it's not a key
+            members.append(self.serializer.dumps(key))
+            pipe.zincrby(self.name, members[-1], deltas[key])
+        _publish(self, pipe, members)
+        return dict(zip(keys, pipe.execute()))
+
+    def set_scores(self, scores, nx=False, xx=False, gt=False, lt=False,
+                   ch=False):
+        """
+        Set the scores of many keys in one command, conditionally, as ZADD
+        does (Redis 3.0.2 and later, 6.2 for gt and lt).  O(M log N)
+        :param scores: A dict of keys to their new scores
+        :param nx: Only add new keys, leaving existing ones alone
+        :param xx: Only update existing keys, adding none
+        :param gt: Only update scores that would increase
+        :param lt: Only update scores that would decrease
+        :param ch: Count the keys changed, not just the ones added
+        :return: The number of keys added (or changed, with ch)
+        """
+        flags = [flag for flag, given in (('NX', nx), ('XX', xx), ('GT', gt),
+                                          ('LT', lt), ('CH', ch)) if given]
+        pairs = []
+        for key, score in iteritems(scores):
+            key.__hash__()  # See that it's hashable, otherwise it's not a key
+            pairs.extend((score + 0.0, self.serializer.dumps(key)))
+        if not len(pairs):
+            return 0
+        return _changing(self, lambda client: client.execute_command(
+            'ZADD', self.name, *(flags + pairs)), pairs[1::2])
+
+    def top(self, n):
+        """
+        O(log N + n)
+        :return: A list of the n keys with the highest scores, and their
+            scores, highest first
+        """
+        if n <= 0:
+            return []
+        return self.__pairs(self.redis.zrevrange(self.name, 0, n - 1,
+                                                 withscores=True))
+
+    def bottom(self, n):
+        """
+        O(log N + n)
+        :return: A list of the n keys with the lowest scores, and their
+            scores, lowest first
+        """
+        if n <= 0:
+            return []
+        return self.__pairs(self.redis.zrange(self.name, 0, n - 1,
+                                              withscores=True))
+
+    def __pairs(self, pairs):
+        return [(self.serializer.loads(k), v) for k, v in pairs]
+
+    def __pop(self, command, n):
+        if n <= 0:
+            return []
+        try:
+            flat = self.redis.execute_command(command, self.name, n)
+            pairs = list(zip(flat[::2], (float(v) for v in flat[1::2])))
+        except ResponseError:  # Redis before 5.0
+            pipe = self.redis.pipeline()
+            if command == 'ZPOPMIN':
+                pipe.zrange(self.name, 0, n - 1, withscores=True)
+                pipe.zremrangebyrank(self.name, 0, n - 1)
+            else:
+                pipe.zrevrange(self.name, 0, n - 1, withscores=True)
+                pipe.zremrangebyrank(self.name, -n, -1)
+            pairs = pipe.execute()[0]
+        if pairs:
+            _publish(self, self.redis, [k for k, v in pairs])
+        return self.__pairs(pairs)
+
+    def pop_min(self, n=1):
+        """
+        Remove the n keys with the lowest scores, atomically.  O(n log N)
+        :return: A list of the keys removed and their scores, lowest first
+        """
+        return self.__pop('ZPOPMIN', n)
+
+    def pop_max(self, n=1):
+        """
+        Remove the n keys with the highest scores, atomically.  O(n log N)
+        :return: A list of the keys removed and their scores, highest first
+        """
+        return self.__pop('ZPOPMAX', n)
+
     def __delitem__(self, value):
-        if self.redis.zrem(self.name, self.serializer.dumps(value)) == 0:
+        member = self.serializer.dumps(value)
+        if _changing(self, lambda client: client.zrem(self.name, member),
+                     [member]) == 0:
             raise KeyError()
 
+    def __peer_names(self, others):
+        names = []
+        for other in others:
+            if not _peer(self, other, RedisSortedSet, 'serializer'):
+                raise TypeError('Sorted sets can only be combined with '
+                                'RedisSortedSets in the same database, '
+                                'using the same serializer')
+            names.append(other.name)
+        return names
+
+    def __combine(self, command, others, weights, aggregate):
+        """
+        Check the arguments for ZUNIONSTORE or ZINTERSTORE
+        :param weights: Multipliers for the scores of this set and each of
+            the others, in that order, default all 1
+        :param aggregate: How to combine the scores of a key in more than one
+            set: 'SUM' (the default), 'MIN' or 'MAX'
+        :return: A function(client, name) to queue or run the command,
+            storing the result in name
+        """
+        keys = [self.name] + self.__peer_names(others)
+        args = [len(keys)] + keys
+        if weights is not None:
+            if len(weights) != len(keys):
+                raise ValueError('Give one weight for each set')
+            args.append('WEIGHTS')
+            args.extend(weights)
+        if aggregate is not None:
+            args.extend(('AGGREGATE', aggregate.upper()))
+        return lambda client, name: client.execute_command(command, name,
+                                                           *args)
+
+    def __stream(self, store, withscores):
+        """
+        Store a combination of sets in a temporary key, and stream it
+        :param store: A function(name, ttl) to store the combination in
+            name, to live for ttl seconds
+        """
+        tmp = b'-=-COMBINING-=-' + _token()
+        # Don't leave the result behind if the stream is abandoned.
+        store(tmp, 3600)
+        try:
+            result = RedisSortedSet(tmp, self.redis, self.serializer)
+            result.page_size = self.page_size
+            for x in (result.items() if withscores else result):
+                yield x
+        finally:
+            self.redis.delete(tmp)
+
+    def __store_with_ttl(self, command):
+        """:return: A function(name, ttl) to run command, then expire name"""
+        def store(name, ttl):
+            pipe = self.redis.pipeline()
+            command(pipe, name)
+            pipe.expire(name, ttl)
+            pipe.execute()
+        return store
+
+    def union(self, others, weights=None, aggregate=None, withscores=True):
+        """
+        Stream the union of this set and the others, computed on the server.
+        The arguments are checked when union is called, and the result is
+        computed when the stream starts.
+        :param others: RedisSortedSets in the same database
+        :param weights: Multipliers for the scores of this set and each of
+            the others, in that order, default all 1
+        :param aggregate: How to combine the scores of a key in more than one
+            set: 'SUM' (the default), 'MIN' or 'MAX'
+        :param withscores: True to generate (key, score) pairs, in order of
+            score, False for the keys alone
+        """
+        return self.__stream(self.__store_with_ttl(self.__combine(
+            'ZUNIONSTORE', others, weights, aggregate)), withscores)
+
+    def intersection(self, others, weights=None, aggregate=None,
+                     withscores=True):
+        """
+        Like union, but for the keys in this set and all of the others
+        """
+        return self.__stream(self.__store_with_ttl(self.__combine(
+            'ZINTERSTORE', others, weights, aggregate)), withscores)
+
+    def difference(self, others, withscores=True):
+        """
+        Stream the keys of this set that are in none of the others, with
+        their scores from this set, computed on the server, as for union.
+        O(N * K), for N keys in this set and K others, as for ZDIFFSTORE.
+        Before Redis 6.2, the difference is found a page at a time, so the
+        server isn't blocked for all of it, and changes made meanwhile may
+        or may not be seen.
+        """
+        keys = [self.name] + self.__peer_names(others)
+        return self.__stream(
+            lambda name, ttl: _zdiffstore(self.redis, name, keys, ttl),
+            withscores)
+
+    def union_store(self, name, others, weights=None, aggregate=None):
+        """
+        Store the union of this set and the others in Redis, without
+        transferring it (ZUNIONSTORE)
+        :param name: The key for the result, replaced if it exists
+        :return: A RedisSortedSet of the result
+        """
+        self.__combine('ZUNIONSTORE', others, weights, aggregate)(
+            self.redis, name)
+        return RedisSortedSet(name, self.redis, self.serializer)
+
+    def intersection_store(self, name, others, weights=None, aggregate=None):
+        """
+        Like union_store, but for the intersection (ZINTERSTORE)
+        """
+        self.__combine('ZINTERSTORE', others, weights, aggregate)(
+            self.redis, name)
+        return RedisSortedSet(name, self.redis, self.serializer)
+
+    def difference_store(self, name, others):
+        """
+        Like union_store, but for the keys of this set that are in none of
+        the others (ZDIFFSTORE, or as for difference before Redis 6.2)
+        """
+        _zdiffstore(self.redis, name,
+                    [self.name] + self.__peer_names(others))
+        return RedisSortedSet(name, self.redis, self.serializer)
+
     def update(*args, **kwds):
-        new_stuff = {}
+        """
+        Like dict.update, but the input is streamed to Redis in chunks, so it
+        may be a generator of (key, score) pairs too large to hold in memory.
+        """
         self = args[0]
-        args = args[1:]
-        new_stuff.update(*args, **kwds)
-        self.redis.zadd(self.name,
-                        *[i for sub in [(v + 0, self.serializer.dumps(k))
-                                        for k, v in iteritems(new_stuff)]
-                          for i in sub])
+        if len(args) > 2:
+            raise TypeError('update expected at most 1 positional argument, '
+                            'got %d' % (len(args) - 1))
+
+        def pairs():
+            if len(args) > 1:
+                other = args[1]
+                if isinstance(other, Mapping):
+                    for pair in iteritems(other):
+                        yield pair
+                elif hasattr(other, 'keys'):
+                    for k in other.keys():
+                        yield k, other[k]
+                else:
+                    for k, v in other:
+                        yield k, v
+            for pair in iteritems(kwds):
+                yield pair
+
+        def zadd(client, chunk):
+            client.zadd(self.name, *[i for sub in chunk for i in sub])
+            _publish(self, client, [member for score, member in chunk])
+
+        _write_chunks(self.redis, zadd,
+                      _chunked(((k.__hash__() or True) and v + 0,
+                                self.serializer.dumps(k))
+                               for k, v in pairs()))
+
+    def from_arrays(self, members, scores):
+        """
+        Add or update many keys at once, with scores from a NumPy array.  The
+        scores are encoded in bulk rather than one Python float at a time,
+        and sent in chunks.  Requires NumPy.
+        :param members: A sequence of keys
+        :param scores: A sequence of scores, the same length as members,
+            anything numpy.asarray accepts
+        """
+        import numpy
+        scores = numpy.asarray(scores, dtype=numpy.float64)
+        if scores.ndim != 1 or len(scores) != len(members):
+            raise ValueError('Give one score for each member')
+        # Formats each score with enough digits to read back exactly
+        encoded = scores.astype(numpy.bytes_).tolist()
+
+        def zadd(client, chunk):
+            args = []
+            for score, member in chunk:
+                args.append(score)
+                args.append(self.serializer.dumps(member))
+            client.zadd(self.name, *args)
+            _publish(self, client, args[1::2])
+
+        _write_chunks(self.redis, zadd, _chunked(zip(encoded, members)))
+
+    def to_arrays(self, order='asc'):
+        """
+        Read the whole set into NumPy arrays, a page at a time.  The scores
+        are parsed in bulk rather than one Python float at a time.
+        Requires NumPy.
+        :param order: 'asc' for lowest score first, 'desc' for highest
+        :return: (members, scores), an array of objects and an array of
+            float64
+        """
+        import numpy
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        members = []
+        scores = []
+        for k, v in self.__paged(lambda start, num: self.redis.zrange(
+                self.name, start, start + num - 1, desc=order == 'desc',
+                withscores=True, score_cast_func=bytes)):
+            members.append(self.serializer.loads(k))
+            scores.append(v)
+        member_array = numpy.empty(len(members), dtype=object)
+        member_array[:] = members
+        return member_array, \
+            numpy.array(scores, dtype=numpy.bytes_).astype(numpy.float64)
 
     def clear(self):
-        self.redis.delete(self.name)
+        _changing(self, lambda client: client.delete(self.name), [])
 
     def __repr__(self):
         return _repr(self, '{%s}')
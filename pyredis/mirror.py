@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import bisect
+import collections
+import threading
+import time
+from .collections import RedisDict, RedisSortedSet, _chunked, _repr, \
+    _unpack_fields, _write_chunks
+from ._compat import monotonic
+__author__ = 'ke4roh'
+
+# The keyspace events for writes whose fields or members are published on
+# the change channel, by the mirrored collection's type
+_FIELD_EVENTS = {
+    RedisDict: frozenset((b'hset', b'hdel', b'hincrby', b'hincrbyfloat')),
+    RedisSortedSet: frozenset((b'zadd', b'zincr', b'zrem', b'zpopmin',
+                               b'zpopmax', b'zremrangebyrank')),
+}
+
+_GONE = object()
+
+
+class RedisMirror(collections.Mapping):
+    """
+    A read-only copy, in local memory, of a RedisDict or RedisSortedSet, so
+    reads and iteration need no round trips.  A mirror of a RedisSortedSet
+    maps its keys to their scores, in order.
+
+    If the collection was made with publish_changes=True, and so are all
+    its writers, the mirror follows the fields or members each write
+    changes, and fetches just those, in one round trip per batch.
+    Otherwise it reloads the whole collection, a page at a time, when
+    keyspace notifications say it changed.  Either way, writes that replace
+    the whole key (DEL, RENAME, expiry...) are seen through keyspace
+    notifications, and the whole collection is reloaded to resync after a
+    lost connection.  The server must publish notifications for the key's
+    events, e.g. CONFIG SET notify-keyspace-events Kghz (or KA).
+
+    Changes are applied once they pause for debounce seconds, but no more
+    than max_delay seconds after the first.  Without notifications, give a
+    max_age to reload periodically instead, or call refresh.  Each change
+    makes a new copy of the local data, so readers iterating the old one
+    are undisturbed.
+
+    Each update increments version; stale and staleness tell whether
+    changes have been seen that the copy doesn't have yet.
+    """
+
+    page_size = 1000
+
+    def __init__(self, collection, debounce=0.05, max_delay=1, max_age=None,
+                 listen=True):
+        """
+        :param collection: The RedisDict or RedisSortedSet to mirror
+        :param debounce: Seconds without changes to wait before updating
+        :param max_delay: The most seconds to wait to update after a change
+        :param max_age: Reload at least this often, in seconds, changes or
+            not, default None - only on changes
+        :param listen: False to load once and reload only when refresh is
+            called
+        """
+        if not isinstance(collection, (RedisDict, RedisSortedSet)):
+            raise TypeError('Only RedisDict and RedisSortedSet can be '
+                            'mirrored')
+        self.collection = collection
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.version = 0
+        self.loaded_at = None
+        self.last_error = None
+        self.__sorted = isinstance(collection, RedisSortedSet)
+        self.__field_events = frozenset() if collection.changes is None \
+            else _FIELD_EVENTS[RedisSortedSet if self.__sorted else RedisDict]
+        # (keys to values; for a sorted set, also (score, member) pairs in
+        # order, and members to keys), replaced whole by each change
+        self.__copy = ({}, [], {}) if self.__sorted else ({}, None, None)
+        self.__pending = set()
+        self.__reload = False
+        self.__loaded = None
+        self.__changed_at = None
+        self.__last_change = None
+        self.__loading_since = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__pubsub = None
+        self.__thread = None
+        if listen:
+            # Subscribe before loading, so no change is missed in between
+            redis = collection.redis
+            db = redis.connection_pool.connection_kwargs.get('db', 0)
+            name = collection.name
+            if not isinstance(name, bytes):
+                name = name.encode('utf-8')
+            self.__keyspace = \
+                ('__keyspace@%d__:' % int(db)).encode('utf-8') + name
+            channels = [self.__keyspace]
+            if collection.changes is not None:
+                channels.append(collection.changes)
+            self.__pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            self.__pubsub.subscribe(*channels)
+        self.refresh()
+        if listen:
+            self.__thread = threading.Thread(target=self.__run,
+                                             name='RedisMirror')
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def refresh(self):
+        """Reload the whole copy now"""
+        with self.__lock:
+            self.__loading_since = self.__changed_at
+            self.__changed_at = None
+            # Changes seen from here on are applied after the load
+            self.__pending = set()
+            self.__reload = False
+            try:
+                copy = self.__load()
+            except Exception:
+                # Still stale
+                self.__changed_at = self.__loading_since or monotonic()
+                self.__reload = True
+                raise
+            finally:
+                self.__loading_since = None
+            self.__loaded = monotonic()
+            self.__updated(copy)
+
+    def __updated(self, copy):
+        self.__copy = copy
+        self.loaded_at = time.time()
+        self.version += 1
+
+    def __load(self):
+        c = self.collection
+        if self.__sorted:
+            data, order, keys = {}, [], {}
+            start = 0
+            while True:
+                page = c.redis.zrange(c.name, start,
+                                      start + self.page_size - 1,
+                                      withscores=True)
+                for member, score in page:
+                    key = c.serializer.loads(member)
+                    data[key] = score
+                    order.append((score, member))
+                    keys[member] = key
+                if len(page) < self.page_size:
+                    return data, order, keys
+                start += self.page_size
+        return dict((c.key_serializer.loads(k), c.serializer.loads(v))
+                    for k, v in c.redis.hscan_iter(c.name,
+                                                   count=self.page_size)), \
+            None, None
+
+    def __apply(self):
+        """Fetch the pending fields or members, and update the copy"""
+        with self.__lock:
+            self.__loading_since = self.__changed_at
+            self.__changed_at = None
+            fields, self.__pending = list(self.__pending), set()
+            if not fields:
+                self.__loading_since = None
+                return
+            try:
+                values = self.__fetch(fields)
+            except Exception:
+                self.__pending.update(fields)
+                self.__changed_at = self.__loading_since or monotonic()
+                raise
+            finally:
+                self.__loading_since = None
+            c = self.collection
+            data, order, keys = self.__copy
+            data = dict(data)
+            if self.__sorted:
+                order = list(order)
+                keys = dict(keys)
+                for member, score in zip(fields, values):
+                    key = keys.pop(member, _GONE)
+                    if key is not _GONE:
+                        old = (data.pop(key), member)
+                        del order[bisect.bisect_left(order, old)]
+                    if score is not None:
+                        key = c.serializer.loads(member)
+                        score = float(score)
+                        data[key] = score
+                        keys[member] = key
+                        bisect.insort(order, (score, member))
+            else:
+                for field, value in zip(fields, values):
+                    key = c.key_serializer.loads(field)
+                    if value is None:
+                        data.pop(key, None)
+                    else:
+                        data[key] = c.serializer.loads(value)
+            self.__updated((data, order, keys))
+
+    def __fetch(self, fields):
+        """:return: The current value of each field, None if it's gone"""
+        c = self.collection
+        if self.__sorted:
+            return _write_chunks(
+                c.redis,
+                lambda client, chunk: [client.zscore(c.name, m)
+                                       for m in chunk],
+                _chunked(fields))
+        return [v for values in _write_chunks(
+            c.redis, lambda client, chunk: client.hmget(c.name, chunk),
+            _chunked(fields)) for v in values]
+
+    def __heard(self, message):
+        """Note a change from a message"""
+        if message['channel'] == self.__keyspace:
+            if message['data'] in self.__field_events:
+                return  # It's on the change channel too
+            fields = None
+        else:
+            fields = _unpack_fields(message['data'])
+        with self.__lock:
+            if fields:
+                self.__pending.update(fields)
+            else:
+                self.__reload = True
+            self.__changed(monotonic())
+
+    def __changed(self, now):
+        """Note that there's a change to apply.  Hold the lock."""
+        if self.__changed_at is None:
+            self.__changed_at = now
+        self.__last_change = now
+
+    def __run(self):
+        while not self.__stop.is_set():
+            now = monotonic()
+            if self.__changed_at is not None:
+                timeout = max(0, min(
+                    self.__last_change + self.debounce,
+                    self.__changed_at + self.max_delay) - now)
+            else:
+                timeout = 1
+            if self.max_age is not None:
+                timeout = max(0, min(timeout,
+                                     self.__loaded + self.max_age - now))
+            try:
+                message = self.__pubsub.get_message(timeout=timeout)
+                if message is not None:
+                    self.__heard(message)
+                if self.__due():
+                    if self.__reload or (self.max_age is not None and
+                                         monotonic() >= self.__loaded +
+                                         self.max_age):
+                        self.refresh()
+                    else:
+                        self.__apply()
+            except Exception as e:
+                # e.g. a lost connection, or a value or message that can't
+                # be decoded.  The copy may have missed changes; reload it,
+                # after a pause, rather than stop following them.
+                self.last_error = e
+                with self.__lock:
+                    self.__reload = True
+                    self.__changed(monotonic())
+                self.__stop.wait(min(1, self.max_delay))
+
+    def __due(self):
+        now = monotonic()
+        if self.__changed_at is not None and (
+                now >= self.__last_change + self.debounce or
+                now >= self.__changed_at + self.max_delay):
+            return True
+        return self.max_age is not None and \
+            now >= self.__loaded + self.max_age
+
+    @property
+    def stale(self):
+        """True if changes have been seen that aren't in the copy yet"""
+        return self.__changed_at is not None or \
+            self.__loading_since is not None
+
+    @property
+    def staleness(self):
+        """
+        The seconds since the first change that isn't in the copy yet, 0 if
+        there's none
+        """
+        since = [t for t in (self.__changed_at, self.__loading_since)
+                 if t is not None]
+        return monotonic() - min(since) if since else 0
+
+    def close(self):
+        """Stop listening for changes.  The copy remains readable."""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__pubsub is not None:
+            self.__pubsub.close()
+            self.__pubsub = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getitem__(self, key):
+        return self.__copy[0][key]
+
+    def __contains__(self, key):
+        return key in self.__copy[0]
+
+    def __iter__(self):
+        data, order, keys = self.__copy
+        if order is None:
+            return iter(data)
+        return (keys[member] for score, member in order)
+
+    def __len__(self):
+        return len(self.__copy[0])
+
+    @property
+    def name(self):
+        return self.collection.name
+
+    def __repr__(self):
+        return _repr(self, '{%s}')
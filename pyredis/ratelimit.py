@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import pickle
+from .collections import _default_redis, _execute, _Script, _token
+from .ttl import _LUA_NOW
+__author__ = 'ke4roh'
+
+# Each script decides whether to allow ARGV[2] units of use of the key
+# KEYS[1] at the time ARGV[1] (or the server's time, if that's empty),
+# records it if so, and returns 1 if allowed, else 0.
+
+# KEYS[1] is a sorted set of uses, scored by time.  ARGV[3] is the limit,
+# ARGV[4] the window in seconds, and ARGV[5] a token to make members unique.
+_SLIDING_WINDOW = _Script(_LUA_NOW + """
+local cost = tonumber(ARGV[2])
+local window = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) + cost > tonumber(ARGV[3]) then
+    return 0
+end
+local args = {}
+for i = 1, cost do
+    args[#args + 1] = now
+    args[#args + 1] = ARGV[5] .. i
+end
+if #args > 0 then
+    redis.call('ZADD', KEYS[1], unpack(args))
+end
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return 1
+""")
+
+# KEYS[1] is a hash of the current window's number (w) and its use (n).
+# ARGV[3] is the limit and ARGV[4] the window in seconds.
+_FIXED_WINDOW = _Script(_LUA_NOW + """
+local cost = tonumber(ARGV[2])
+local window = tonumber(ARGV[4])
+local w = math.floor(now / window)
+local current = redis.call('HMGET', KEYS[1], 'w', 'n')
+local n = 0
+if tonumber(current[1]) == w then
+    n = tonumber(current[2])
+end
+if n + cost > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HMSET', KEYS[1], 'w', w, 'n', n + cost)
+redis.call('PEXPIRE', KEYS[1], math.ceil(((w + 1) * window - now) * 1000))
+return 1
+""")
+
+# KEYS[1] is a hash of the tokens in the bucket and when they were counted
+# (ts).  ARGV[3] is the capacity and ARGV[4] the tokens added per second.
+_TOKEN_BUCKET = _Script(_LUA_NOW + """
+local cost = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local current = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(current[1]) or capacity
+local ts = tonumber(current[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+-- Once the bucket would be full again, it's the same as no bucket
+redis.call('PEXPIRE', KEYS[1],
+           math.ceil((capacity - tokens) / rate * 1000) + 1)
+return allowed
+""")
+
+
+class _RateLimiter(object):
+    """
+    The common parts of the rate limiters.  Each decision is one script call,
+    made by the Redis clock unless a time function is given.
+    """
+
+    _script = None
+    # True if the script needs a token to make each use unique, ARGV[5]
+    _unique = False
+
+    def __init__(self, name, params, redis, key_serializer, time):
+        """
+        :param params: The limiter's parameters for its script, ARGV[3..]
+        """
+        self.name = ((type(name) is bytes and name) or
+                     str(name).encode('utf-8')) + b':'
+        self.redis = redis if redis is not None else _default_redis()
+        self.key_serializer = key_serializer
+        self.time = time
+        self._params = list(params)
+
+    def _key(self, key):
+        return self.name + self.key_serializer.dumps(key)
+
+    def __now(self):
+        return '' if self.time is None else repr(float(self.time()))
+
+    def __decide(self, client, now, key, cost):
+        args = [now, cost] + self._params
+        if self._unique:
+            args.append(_token() + b':')
+        return self._script(client, keys=[self._key(key)], args=args)
+
+    def allow(self, key, cost=1):
+        """
+        Decide whether to allow some use, and record it if so.  O(1) round
+        trips.
+        :param key: Whose use it is, e.g. a user or an address
+        :param cost: How much use it is
+        :return: True if the use is allowed, False if it's over the limit
+        """
+        return self.__decide(self.redis, self.__now(), key, cost) == 1
+
+    def allow_many(self, keys, cost=1):
+        """
+        Like allow, for many keys at once, in one pipelined round trip (and
+        one more to load the script, the first time on each connection pool)
+        :param keys: An iterable of keys
+        :param cost: How much use each one is
+        :return: A list of True or False for each key
+        """
+        now = self.__now()
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            self.__decide(pipe, now, key, cost)
+        return [r == 1 for r in _execute(pipe)]
+
+    def reset(self, key):
+        """Forget the use of a key"""
+        self.redis.delete(self._key(key))
+
+
+class SlidingWindowLimiter(_RateLimiter):
+    """
+    Allows at most limit uses of each key in any window seconds.  Uses are
+    kept in a sorted set for each key, so memory is proportional to the
+    limit; cost should be a small integer.
+    """
+
+    _script = _SLIDING_WINDOW
+    _unique = True
+
+    def __init__(self, name, limit, window, redis=None,
+                 key_serializer=pickle, time=None):
+        """
+        :param name: The prefix of the keys in Redis
+        :param limit: The most uses allowed in a window
+        :param window: The length of the window, in seconds
+        :param redis: The StrictRedis connection to use
+        :param key_serializer: An object containing a function "dumps" to
+            turn a key into a byte array.  Default = pickle
+        :param time: a function to return the current time, default = use
+            the Redis clock
+        """
+        super(SlidingWindowLimiter, self).__init__(
+            name, [limit, window], redis, key_serializer, time)
+        self.limit = limit
+        self.window = window
+
+
+class FixedWindowLimiter(_RateLimiter):
+    """
+    Allows at most limit uses of each key in each window of window seconds,
+    counted from the epoch.  Cheaper than a sliding window, but allows bursts
+    of up to twice the limit across the boundary between windows.
+    """
+
+    _script = _FIXED_WINDOW
+
+    def __init__(self, name, limit, window, redis=None,
+                 key_serializer=pickle, time=None):
+        """
+        :param name: The prefix of the keys in Redis
+        :param limit: The most uses allowed in a window
+        :param window: The length of the window, in seconds
+        :param redis: The StrictRedis connection to use
+        :param key_serializer: As for SlidingWindowLimiter
+        :param time: As for SlidingWindowLimiter
+        """
+        super(FixedWindowLimiter, self).__init__(
+            name, [limit, window], redis, key_serializer, time)
+        self.limit = limit
+        self.window = window
+
+
+class TokenBucketLimiter(_RateLimiter):
+    """
+    Allows bursts of up to capacity uses of each key, refilling at rate uses
+    per second.
+    """
+
+    _script = _TOKEN_BUCKET
+
+    def __init__(self, name, capacity, rate, redis=None,
+                 key_serializer=pickle, time=None):
+        """
+        :param name: The prefix of the keys in Redis
+        :param capacity: The most uses allowed at once
+        :param rate: The uses allowed per second, on average, more than 0
+        :param redis: The StrictRedis connection to use
+        :param key_serializer: As for SlidingWindowLimiter
+        :param time: As for SlidingWindowLimiter
+        """
+        if not rate > 0:
+            raise ValueError('rate must be more than 0')
+        super(TokenBucketLimiter, self).__init__(
+            name, [capacity, rate], redis, key_serializer, time)
+        self.capacity = capacity
+        self.rate = rate
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import math
+import pickle
+import time
+from redis.exceptions import ResponseError
+from .collections import _default_redis, _Script, _server_version
+from .ttl import _LUA_NOW
+from ._compat import monotonic
+__author__ = 'ke4roh'
+
+# How a scheduler waits for items to come due, by the server's version:
+# polling before Redis 5, which has no BZPOPMIN, blocking for whole seconds
+# before Redis 6, and blocking for fractions of seconds after
+_POLL = 'poll'
+_BLOCK_SECONDS = 'seconds'
+_BLOCK = 'block'
+
+# The scripts below work on a scheduler's keys: KEYS[1] holds items by the
+# time they're due, KEYS[2] claimed items by the time they may be claimed
+# again, and KEYS[3] rings, with its one member, when there's something for
+# a waiting worker to do sooner than it expected.  ARGV[1] is the time, or
+# empty for the server's.
+
+# soonest() is the earliest time an item is due or a claim times out, nil
+# if there's none.  ring() wakes a waiting worker.
+_LUA_DOORBELL = """
+local function soonest()
+    local t = nil
+    for k = 1, 2 do
+        local first = redis.call('ZRANGE', KEYS[k], 0, 0, 'WITHSCORES')
+        if #first > 0 and (t == nil or tonumber(first[2]) < t) then
+            t = tonumber(first[2])
+        end
+    end
+    return t
+end
+local function ring()
+    redis.call('ZADD', KEYS[3], 0, 'ring')
+end
+"""
+
+# Schedule ARGV[3] at the time ARGV[2], or if that's empty, ARGV[4] seconds
+# from now, ringing if it's due before anything else
+_SCHEDULE = _Script(_LUA_NOW + _LUA_DOORBELL + """
+local at = tonumber(ARGV[2]) or now + tonumber(ARGV[4])
+redis.call('ZREM', KEYS[2], ARGV[3])
+local before = soonest()
+redis.call('ZADD', KEYS[1], at, ARGV[3])
+if before == nil or at < before then
+    ring()
+end
+""")
+
+# Move up to ARGV[3] claims that have timed out back to due now
+_LUA_REQUEUE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now,
+                           'LIMIT', 0, ARGV[3])
+for i, item in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('ZADD', KEYS[1], now, item)
+end
+"""
+
+_REQUEUE = _Script(_LUA_NOW + _LUA_REQUEUE + """
+return #expired
+""")
+
+# Claim up to ARGV[3] due items for ARGV[2] seconds, after requeueing as
+# many timed out claims.  Return the seconds until the next item is due or
+# claim times out (empty if there's none), then the items.  If more are
+# due already, ring, so another waiting worker takes them.
+_CLAIM = _Script(_LUA_NOW + _LUA_DOORBELL + _LUA_REQUEUE + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now,
+                       'LIMIT', 0, ARGV[3])
+local deadline = now + tonumber(ARGV[2])
+for i, item in ipairs(due) do
+    redis.call('ZREM', KEYS[1], item)
+    redis.call('ZADD', KEYS[2], deadline, item)
+end
+local wake = soonest()
+local result = {''}
+if wake then
+    result[1] = tostring(math.max(0, wake - now))
+    if #due > 0 and wake <= now then
+        ring()
+    end
+end
+for i, item in ipairs(due) do
+    result[#result + 1] = item
+end
+return result
+""")
+
+# Return the claimed ARGV[3] to due in ARGV[2] seconds, 1 if it was
+# claimed, ringing as for _SCHEDULE
+_RELEASE = _Script(_LUA_NOW + _LUA_DOORBELL + """
+if redis.call('ZREM', KEYS[2], ARGV[3]) == 0 then
+    return 0
+end
+local at = now + tonumber(ARGV[2])
+local before = soonest()
+redis.call('ZADD', KEYS[1], at, ARGV[3])
+if before == nil or at < before then
+    ring()
+end
+return 1
+""")
+
+
+class Scheduler(object):
+    """
+    A queue of delayed jobs.  Items are scheduled for a time, then claimed by
+    workers once they're due.  A claimed item must be acknowledged within the
+    visibility timeout, or it's due again, to be claimed by another worker.
+
+    The items are kept in sorted sets: name, of items by the time they're
+    due; name + ':processing', of claimed items by the time their claims
+    time out; and name + ':doorbell', which workers blocked in claim wait on.
+    The doorbell holds at most one member, added only when an item comes due
+    sooner than the waiting workers expect.  Each item is scheduled at most
+    once; scheduling it again reschedules it.
+    """
+
+    # How often claim checks for due items when the server can't block
+    poll_interval = 0.1
+
+    def __init__(self, name, redis=None, serializer=pickle,
+                 visibility_timeout=30, time=None):
+        """
+        :param name: The name of this scheduler - the key of its due items
+        :param redis: The StrictRedis connection to use
+        :param serializer: An object containing functions "dumps" to turn an
+            object (to store) into a byte array, and
+            "loads" to turn a byte array into an object.  Default = pickle
+        :param visibility_timeout: How long, in seconds, a worker has to
+            acknowledge an item it claimed
+        :param time: a function to return the current time, default = use
+            the Redis clock
+        """
+        self.name = name
+        self.processing_name = name + \
+            (b':processing' if isinstance(name, bytes) else ':processing')
+        self.doorbell_name = name + \
+            (b':doorbell' if isinstance(name, bytes) else ':doorbell')
+        self.redis = redis if redis is not None else _default_redis()
+        self.serializer = serializer
+        self.visibility_timeout = visibility_timeout
+        self.time = time
+        self.__wait_mode = None  # Found from the server when first needed
+
+    def __run(self, script, *args):
+        now = '' if self.time is None else repr(float(self.time()))
+        return script(self.redis, keys=[self.name, self.processing_name,
+                                        self.doorbell_name],
+                      args=(now,) + args)
+
+    def schedule(self, item, at=None, delay=None):
+        """
+        Schedule an item, replacing any schedule or claim it has
+        :param item: The item
+        :param at: When it's due, by the scheduler's clock
+        :param delay: Alternatively, how many seconds from now it's due
+        """
+        if at is not None and delay is not None:
+            raise ValueError('Give at or delay, not both')
+        self.__run(_SCHEDULE, '' if at is None else repr(float(at)),
+                   self.serializer.dumps(item), repr(float(delay or 0)))
+
+    def claim_due(self, n=1, visibility_timeout=None):
+        """
+        Claim up to n items that are due, in one round trip.  Claims that
+        timed out are requeued first.
+        :param n: The most items to claim
+        :param visibility_timeout: How long to hold the claims, default is
+            the scheduler's visibility_timeout
+        :return: A list of the items, soonest due first
+        """
+        return self.__claim(n, visibility_timeout)[1]
+
+    def __claim(self, n, visibility_timeout):
+        """:return: (seconds until there's more to do, or None, items)"""
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+        result = self.__run(_CLAIM, repr(float(visibility_timeout)), n)
+        wait = float(result[0]) if result[0] else None
+        return wait, [self.serializer.loads(x) for x in result[1:]]
+
+    def claim(self, timeout=None, visibility_timeout=None):
+        """
+        Claim one item, waiting for it to come due if necessary.  Waiting
+        blocks on the server (BZPOPMIN, Redis 5+), or polls every
+        poll_interval seconds on older servers.
+        :param timeout: The most seconds to wait, None to wait indefinitely
+        :param visibility_timeout: As for claim_due
+        :return: The item, or None if none came due in time
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            wait, items = self.__claim(1, visibility_timeout)
+            if items:
+                return items[0]
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                wait = remaining if wait is None else min(wait, remaining)
+            self.__wait(wait)
+
+    def __wait(self, seconds):
+        """Wait for seconds (None for indefinitely) or a doorbell"""
+        if self.__wait_mode is None:
+            version = _server_version(self.redis)
+            self.__wait_mode = _POLL if version < (5, 0) else \
+                _BLOCK_SECONDS if version < (6, 0) else _BLOCK
+        if self.__wait_mode != _POLL:
+            if seconds is None:
+                timeout = '0'  # forever
+            elif self.__wait_mode == _BLOCK_SECONDS:
+                timeout = '%d' % max(int(math.ceil(seconds)), 1)
+            else:
+                timeout = '%.3f' % max(seconds, 0.001)
+            try:
+                self.redis.execute_command('BZPOPMIN', self.doorbell_name,
+                                           timeout)
+                return
+            except ResponseError as e:
+                # e.g. renamed away
+                if 'unknown command' not in str(e).lower():
+                    raise
+                self.__wait_mode = _POLL
+        time.sleep(self.poll_interval if seconds is None
+                   else min(seconds, self.poll_interval))
+
+    def ack(self, item):
+        """
+        Acknowledge that a claimed item is done
+        :return: True if it was claimed, False if its claim had timed out
+            and it was requeued, or it was never claimed
+        """
+        return self.redis.zrem(self.processing_name,
+                               self.serializer.dumps(item)) == 1
+
+    def release(self, item, delay=0):
+        """
+        Give up a claim, so the item is due again
+        :param delay: How many seconds from now it's due
+        :return: True if it was claimed, False otherwise
+        """
+        return self.__run(_RELEASE, repr(float(delay)),
+                          self.serializer.dumps(item)) == 1
+
+    def requeue_expired(self, limit=1000):
+        """
+        Make items whose claims have timed out due again.  claim_due does
+        this too, so it's only needed when nothing is claiming.
+        :param limit: The most items to requeue
+        :return: The number of items requeued
+        """
+        return self.__run(_REQUEUE, '', limit)
+
+    def __len__(self):
+        """:return: The number of items scheduled and not claimed"""
+        return self.redis.zcard(self.name)
+
+    def __contains__(self, item):
+        """:return: True if the item is scheduled or claimed"""
+        key = self.serializer.dumps(item)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zscore(self.name, key)
+        pipe.zscore(self.processing_name, key)
+        return any(x is not None for x in pipe.execute())
+
+    def clear(self):
+        self.redis.delete(self.name, self.processing_name,
+                          self.doorbell_name)
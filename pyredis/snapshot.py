@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import struct
+import threading
+from redis.exceptions import ResponseError
+from .collections import _chunked
+from ._compat import queue
+__author__ = 'ke4roh'
+
+# A snapshot is _MAGIC, then a record for each key: a _RECORD header of the
+# lengths of the key (less the namespace) and the DUMP payload, and the
+# key's TTL in milliseconds (0 for none), followed by the key and payload.
+# A header with a key length of _END ends it.
+_MAGIC = b'pyredis-snapshot\x00\x01'
+_RECORD = struct.Struct('>IqI')
+_END = 0xFFFFFFFF
+
+
+def dump_namespace(objects, fp, page_size=None):
+    """
+    Write every key in an ObjectRedis's namespace, with its TTL, to a
+    snapshot file, a page of keys at a time with pipelined DUMP and PTTL.
+    Keys written to while it's running may or may not be included, as for
+    SCAN.  Indexes aren't included.  O(N)
+    :param objects: The ObjectRedis to dump
+    :param fp: A file open for writing bytes
+    :param page_size: The number of keys to dump per round trip
+    :return: The number of keys written
+    """
+    redis = objects.redis
+    start = len(objects.namespace or b'')
+    fp.write(_MAGIC)
+    written = 0
+    for page in _chunked(objects._stored_keys(), page_size):
+        pipe = redis.pipeline(transaction=False)
+        for key in page:
+            pipe.dump(key)
+            pipe.pttl(key)
+        dumped = pipe.execute()
+        for key, value, ttl in zip(page, dumped[::2], dumped[1::2]):
+            # Skip keys gone since the scan (-2), or as good as gone (0,
+            # which RESTORE would read as no expiry); -1 is no expiry
+            if value is None or ttl == -2 or ttl == 0:
+                continue
+            suffix = key[start:]
+            fp.write(_RECORD.pack(len(suffix), 0 if ttl == -1 else ttl,
+                                  len(value)))
+            fp.write(suffix)
+            fp.write(value)
+            written += 1
+    fp.write(_RECORD.pack(_END, 0, 0))
+    return written
+
+
+def restore_namespace(objects, fp, replace=False, workers=4,
+                      page_size=None):
+    """
+    Restore the keys in a snapshot file to an ObjectRedis's namespace, which
+    needn't be the one they were dumped from, with pipelined RESTOREs.  TTLs
+    count from the restore.  Pages of keys are restored by workers threads,
+    each with its own connection, while the file is read; at most about
+    twice as many pages as workers are held in memory.  The indexes
+    registered with objects are rebuilt.  O(N)
+    :param objects: The ObjectRedis to restore to
+    :param fp: A file open for reading bytes, from dump_namespace
+    :param replace: True to overwrite keys that exist, False to leave them
+        as they are
+    :param workers: The number of pages to restore at once
+    :param page_size: The number of keys to restore per round trip
+    :return: The number of keys restored
+    :raises ValueError: if fp isn't a whole snapshot.  The keys before the
+        problem are restored.
+    """
+    prefix = objects.namespace or b''
+    workers = max(workers, 1)
+    pages = queue.Queue(maxsize=workers)
+    restored = []
+    errors = []
+
+    def work():
+        n = 0
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            if errors:
+                continue  # Drain, so the reader isn't blocked
+            try:
+                n += _restore_page(objects.redis, prefix, page, replace)
+            except Exception as e:
+                errors.append(e)
+        restored.append(n)
+
+    threads = [threading.Thread(target=work, name='restore_namespace')
+               for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        for page in _chunked(_read_records(fp), page_size):
+            if errors:
+                break
+            pages.put(page)
+    finally:
+        for _ in threads:
+            pages.put(None)
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+    for name in objects.indexes:
+        objects.reindex(name)
+    return sum(restored)
+
+
+def _restore_page(redis, prefix, page, replace):
+    """:return: The number of keys restored"""
+    pipe = redis.pipeline(transaction=False)
+    for suffix, ttl, value in page:
+        pipe.restore(prefix + suffix, ttl, value, replace=replace)
+    n = 0
+    for result in pipe.execute(raise_on_error=False):
+        if isinstance(result, ResponseError):
+            # Without replace, keys that exist are left alone
+            if replace or not str(result).startswith('BUSYKEY'):
+                raise result
+        else:
+            n += 1
+    return n
+
+
+def _read_records(fp):
+    """Generate (key suffix, TTL, payload) from a snapshot file"""
+    if _read(fp, len(_MAGIC)) != _MAGIC:
+        raise ValueError('Not a pyredis snapshot')
+    while True:
+        length, ttl, size = _RECORD.unpack(_read(fp, _RECORD.size))
+        if length == _END:
+            return
+        yield _read(fp, length), ttl, _read(fp, size)
+
+
+def _read(fp, n):
+    data = fp.read(n)
+    if len(data) != n:
+        raise ValueError('Truncated snapshot')
+    return data
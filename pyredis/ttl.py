@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import collections
-import redis
+import itertools
 import pickle
+import threading
 import time
-from .collections import ObjectRedis, RedisSortedSet, _repr
+import weakref
+from redis.exceptions import ResponseError
+from .collections import RedisSortedSet, _chunked, _default_redis, _repr, \
+    _execute, _Script, _SCORE_PAGE, _server_version, _write_chunks
+from ._compat import iteritems, monotonic
 __author__ = 'ke4roh'
 
 
@@ -11,35 +16,199 @@ def _missing(x):
     raise KeyError(str(x))
 
 
+def _expiry_key(name):
+    """The key of the sorted set holding expiry times for a collection"""
+    return name + (b':expiry' if isinstance(name, bytes) else ':expiry')
+
+
+def _has_hash_field_ttl(redis):
+    """:return: True if the server can expire hash fields (Redis 7.4+)"""
+    return _server_version(redis) >= (7, 4)
+
+
+# Remove up to ARGV[2] fields that expired before ARGV[1] from a hash
+# (KEYS[1]) and its expiry times (KEYS[2]), 1000 at a time, so no batch is
+# too big to unpack.
+_SWEEP_HASH = _Script("""
+local limit = tonumber(ARGV[2])
+local removed = 0
+while removed < limit do
+    local n = math.min(1000, limit - removed)
+    local dead = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1],
+                            'LIMIT', 0, n)
+    if #dead > 0 then
+        redis.call('HDEL', KEYS[1], unpack(dead))
+        redis.call('ZREM', KEYS[2], unpack(dead))
+    end
+    removed = removed + #dead
+    if #dead < n then
+        break
+    end
+end
+return removed
+""")
+
+
+# Set the local now to ARGV[1] if it's given, else to the server's clock.
+# Writing after TIME, a random command, needs effects replication before
+# Redis 5.
+_LUA_NOW = """
+local now = tonumber(ARGV[1])
+if not now then
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local t = redis.call('TIME')
+    now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+end
+"""
+
+# 1 if ARGV[2] is a member of the TTL set KEYS[1] that hasn't expired, else
+# 0, removing it if it has.  Members expire at the time in their score.
+_TTL_CONTAINS = _Script(_LUA_NOW + """
+local expiry = redis.call('ZSCORE', KEYS[1], ARGV[2])
+if not expiry then
+    return 0
+end
+if tonumber(expiry) <= now then
+    redis.call('ZREM', KEYS[1], ARGV[2])
+    return 0
+end
+return 1
+""")
+
+# Add members to the TTL set KEYS[1].  ARGV[2..] are pairs of a TTL, in
+# seconds from now, and a member.
+_TTL_ADD = _Script(_LUA_NOW + """
+local args = {}
+for i = 2, #ARGV, 2 do
+    args[#args + 1] = now + tonumber(ARGV[i])
+    args[#args + 1] = ARGV[i + 1]
+end
+return redis.call('ZADD', KEYS[1], unpack(args))
+""")
+
+# Make the unexpired members among ARGV[3..] of the TTL set KEYS[1] expire
+# ARGV[2] seconds from now, and return how many there were
+_TTL_TOUCH = _Script(_LUA_NOW + """
+local expiry = now + tonumber(ARGV[2])
+local args = {}
+for i = 3, #ARGV do
+    local old = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if old and tonumber(old) > now then
+        args[#args + 1] = expiry
+        args[#args + 1] = ARGV[i]
+    end
+end
+if #args == 0 then
+    return 0
+end
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', unpack(args))
+""")
+
+
+# Remove up to ARGV[2] members that expired by now from the TTL set KEYS[1],
+# 1000 at a time as for _SWEEP_HASH, and return how many were removed and
+# how many remain unexpired
+_SWEEP_SET = _Script(_LUA_NOW + """
+local limit = tonumber(ARGV[2])
+local removed = 0
+while removed < limit do
+    local n = math.min(1000, limit - removed)
+    local dead = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now,
+                            'LIMIT', 0, n)
+    if #dead > 0 then
+        redis.call('ZREM', KEYS[1], unpack(dead))
+    end
+    removed = removed + #dead
+    if #dead < n then
+        break
+    end
+end
+return {removed, redis.call('ZCOUNT', KEYS[1], '(' .. now, '+inf')}
+""")
+
+
 class RedisTime(object):
     """
     A clock backed by Redis, used to save on round-trip calls to check database
     time for TTL sets.  This is particularly useful during iterating over an
     entire collection - the clock need not be fetched for each item.
+
+    The Redis clock is read now and then, and the local monotonic clock
+    measures the time in between, so the local wall clock may jump without
+    harm.  The offset is taken at the midpoint of the round trip to Redis.
+    The time between checks doubles while the offset holds steady, up to
+    max_refresh_interval, and halves, down to refresh_interval, when it
+    drifts.
     """
 
-    def __init__(self, redis=None, refresh_interval=5):
+    def __init__(self, redis=None, refresh_interval=5,
+                 max_refresh_interval=300, tolerance=0.001):
         """
 
         :param redis: The redis connection to use
         :param refresh_interval: The time (in seconds) to allow between checks
-        of the redis clock
+        of the redis clock, at first and at least
+        :param max_refresh_interval: The most time to allow between checks
+        :param tolerance: The drift, in seconds, beyond half the round trip
+        time, to allow between checks before checking more often
         """
+        self.min_refresh_interval = refresh_interval
         self.refresh_interval = refresh_interval
+        self.max_refresh_interval = max(refresh_interval, max_refresh_interval)
+        self.tolerance = tolerance
         self.redis = redis
-        self.delta = 0
+        self.offset = None
+        self.rtt = None
         self.next_check = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, redis):
+        """
+        :param redis: A StrictRedis
+        :return: The RedisTime for redis's connection pool, created the first
+            time it's needed and kept as long as something uses it
+        """
+        pool = redis.connection_pool
+        with _clocks_lock:
+            clock = _clocks.get(id(pool))
+            if clock is None:
+                clock = cls(redis)
+                _clocks[id(pool)] = clock
+            return clock
+
+    def sync(self):
+        """Read the Redis clock and reset the offset"""
+        start = monotonic()
+        sec, micros = self.redis.time()
+        end = monotonic()
+        offset = sec + micros * 1e-6 - (start + end) / 2
+        if self.offset is not None:
+            if abs(offset - self.offset) <= self.tolerance + (end - start) / 2:
+                self.refresh_interval = min(self.refresh_interval * 2,
+                                            self.max_refresh_interval)
+            else:
+                self.refresh_interval = max(self.refresh_interval / 2.0,
+                                            self.min_refresh_interval)
+        self.offset = offset
+        self.rtt = end - start
+        self.next_check = end + self.refresh_interval
 
     def time(self):
-        if self.next_check < time.time():
-            sec, micros = self.redis.time()
-            rclock = sec + micros * 1e-6
-            now = time.time()
-            self.delta = rclock - now
-            self.next_check = now + self.refresh_interval
-            return rclock
-        else:
-            return self.delta + time.time()
+        if self.next_check <= monotonic():
+            with self.__lock:
+                if self.next_check <= monotonic():
+                    self.sync()
+        return self.offset + monotonic()
+
+
+# The shared RedisTime for each connection pool, by id.  Each clock keeps its
+# client, and so the pool, alive, so the id isn't reused while the clock is
+# registered.
+_clocks = weakref.WeakValueDictionary()
+_clocks_lock = threading.Lock()
 
 
 class RedisTTLSet(collections.MutableSet):
@@ -47,8 +216,8 @@ class RedisTTLSet(collections.MutableSet):
     A set, whose items expire after a specified time.
     """
 
-    def __init__(self, name, ttl, redis=redis.StrictRedis(),
-                 serializer=pickle, time=None):
+    def __init__(self, name, ttl, redis=None,
+                 serializer=pickle, time=None, cleanup_batch=100):
         """
 
         :param name: The name of this collection - its key in Redis
@@ -58,78 +227,478 @@ class RedisTTLSet(collections.MutableSet):
             object (to store) into a byte array, and
             "loads" to turn a byte array into an object.  Default = pickle
         :param time: a function to return the current time, default = use
-            RedisTime.time to periodically check Redis for the official time
+            the RedisTime shared by every collection on this connection pool
+            to periodically check Redis for the official time
             and use the local clock to measure during intervals in-between
             those checks, thus saving some round-trip delays to consult the
             Redis clock, especially with fast iterations over the set
             (which have already discarded the expired members a priori) and
             the slow iterations which might need to discard
             other elements as they expire and before yielding them.
+            Membership tests and additions always use the Redis clock
+            unless a time function is given.
+        :param cleanup_batch: The most expired items to remove from Redis
+            each time the set is iterated or measured.  Expired items are
+            ignored either way; a TTLSweeper can remove the rest.
         """
+        if redis is None:
+            redis = _default_redis()
         self.redis = redis
         self.name = name
         self.serializer = serializer
         self.ttl = ttl
-        self.time = time or RedisTime(redis=redis).time
+        self.time = time or RedisTime.shared(redis).time
+        # With no time function, membership is checked and items are added
+        # by the server's own clock
+        self.__server_clock = time is None
+        self.cleanup_batch = cleanup_batch
         self.dict = RedisSortedSet(name, redis=redis, serializer=serializer)
 
     def __iter__(self):
         """
-        :return: An iterator over all the items.  Only items that were
-          available at the initial call time will be returned.  Only
-          non-expired items will be returned.
+        :return: An iterator over the items that had not expired at the
+          initial call time, fetched a page at a time, soonest to expire
+          first.  Each page after the first starts from the rank of the
+          last item, O(log N + page_size) however many items share an
+          expiry time.  An item refreshed during iteration may be returned
+          twice.
         """
         self.__cleanup()
-        for k, v in self.dict.items():
-            if v < self.time():
-                # If the expiry time has passed, it might have been refreshed
-                if self.__contains__(k):
-                    yield k
-            else:
-                yield k
+        # Page through the members that haven't expired, in order of expiry
+        for k in self.dict.score_range('(' + repr(float(self.time())),
+                                       '+inf'):
+            yield k
 
     def __contains__(self, item):
         """
         :return: True if the item is in the set and not expired, false
             otherwise
         """
-        expiry = self.dict.get(item, None)
-        if expiry is None:
-            return False
-        if expiry < self.time():
-            self.discard(item)
-            return False
-        return True
+        return _TTL_CONTAINS(self.redis, keys=[self.name],
+                             args=[self.__now(),
+                                   self.serializer.dumps(item)]) == 1
 
     def __len__(self):
         """
-        :return: The number of non-expired elements.  This will clear out any
-        expired elements.  Time is O(log(N)+M),
-        where M is the number of expired elements.
+        :return: The number of non-expired elements.  This will clear out up
+        to cleanup_batch expired elements.  Time is O(log(N)+M),
+        where M is the number of elements removed.
         """
-        self.__cleanup()
-        return len(self.dict)
+        return self.__sweep(self.cleanup_batch)[1]
 
     def __cleanup(self):
-        """Remove expired elements. O(log(N) + M)"""
-        self.redis.zremrangebyscore(self.name, float("-inf"), self.time())
+        """Remove some expired elements. O(log(N) + cleanup_batch)"""
+        self.__sweep(self.cleanup_batch)
 
-    def update(self, *other):
-        t = self.time() + self.ttl
-        self.dict.update((dict((k, t) for k in
-                          [item for sublist in other for item in sublist])))
+    def __sweep(self, limit):
+        """:return: [the number of items removed, the number remaining]"""
+        return _SWEEP_SET(self.redis, keys=[self.name],
+                          args=[self.__now(), limit])
 
-    def add(self, item):
-        self.dict[item] = self.time() + self.ttl
+    def sweep(self, limit=None):
+        """
+        Remove expired items from Redis
+        :param limit: The most items to remove, default is cleanup_batch
+        :return: The number of items removed
+        """
+        return self.__sweep(limit or self.cleanup_batch)[0]
 
-    def discard(self, item):
+    def __now(self):
+        """:return: The time to pass to a script, '' for the server's"""
+        return '' if self.__server_clock else repr(float(self.time()))
+
+    def update(self, *others, **kwargs):
+        """
+        Add the items from some iterables, as for any set.
+        :param others: Iterables of items
+        :param ttl: Keyword only, how long the items stay in the set, default
+            is the set's ttl
+        """
+        ttl = kwargs.pop('ttl', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' %
+                            ', '.join(kwargs))
+        if ttl is None:
+            ttl = self.ttl
+        self.__add_all((item, ttl) for other in others for item in other)
+
+    def update_ttls(self, ttls):
+        """
+        Add items, each with its own TTL.
+        :param ttls: A mapping of each item to how long it stays in the set,
+            or None for the set's ttl
+        """
+        self.__add_all((item, self.ttl if ttl is None else ttl)
+                       for item, ttl in iteritems(ttls))
+
+    def __add_all(self, pairs):
+        """
+        Add items in chunks, pipelined if there's more than one
+        :param pairs: An iterable of (item, TTL)
+        """
+        def add(client, chunk):
+            args = [now]
+            for item, item_ttl in chunk:
+                item.__hash__()
+                args.append(item_ttl)
+                args.append(self.serializer.dumps(item))
+            _TTL_ADD(client, keys=[self.name], args=args)
+
+        now = self.__now()
+        chunks = _chunked(pairs)
+        first = next(chunks, None)
+        second = next(chunks, None)
+        if second is None:
+            # One script call, without a pipeline's overhead
+            if first is not None:
+                add(self.redis, first)
+        else:
+            _write_chunks(self.redis, add,
+                          itertools.chain([first, second], chunks))
+
+    def add(self, item, ttl=None):
+        """
+        Add an item, in one script call.
+        :param item: The item to add
+        :param ttl: How long it stays in the set, default is the set's ttl
+        """
+        item.__hash__()
+        _TTL_ADD(self.redis, keys=[self.name],
+                 args=[self.__now(), self.ttl if ttl is None else ttl,
+                       self.serializer.dumps(item)])
+
+    def touch(self, items, ttl=None):
+        """
+        Extend the lives of the items that are in the set, without adding the
+        others, pipelined.
+        :param items: An iterable of items
+        :param ttl: How long they now stay in the set, from now, default is
+            the set's ttl
+        :return: The number of items touched, or None if the set's redis is
+            a pipeline, which will give the number touched in each chunk
+        """
+        now = self.__now()
+        ttl = self.ttl if ttl is None else ttl
+        touched = _write_chunks(
+            self.redis,
+            lambda client, chunk: _TTL_TOUCH(
+                client, keys=[self.name], args=[now, ttl] + chunk),
+            _chunked(self.serializer.dumps(item) for item in items))
+        return None if touched is None else sum(touched)
+
+    def expires_at(self, items):
+        """
+        Look up when items expire, in one round trip.
+        :param items: A sequence of items
+        :return: A list of the time each item expires, by the set's clock,
+            or None for items not in the set or already expired
+        """
+        keys = [self.serializer.dumps(item) for item in items]
+        if not keys:
+            return []
         try:
-            self.dict.__delitem__(item)
-        except KeyError:
-            pass
+            scores = self.redis.execute_command('ZMSCORE', self.name, *keys)
+        except ResponseError:  # before Redis 6.2
+            pipe = self.redis.pipeline(transaction=False)
+            for k in keys:
+                pipe.zscore(self.name, k)
+            scores = pipe.execute()
+        now = self.time()
+        expiries = []
+        for score in scores:
+            score = None if score is None else float(score)
+            expiries.append(score if score is not None and score > now
+                            else None)
+        return expiries
+
+    def discard(self, item):
+        self.redis.zrem(self.name, self.serializer.dumps(item))
 
     def clear(self):
         self.dict.clear()
 
     def __repr__(self):
         return _repr(self, box='{%s}')
+
+
+class RedisTTLDict(collections.MutableMapping):
+    """
+    A dictionary, whose items expire individually after a specified time.
+
+    Where the server supports it (Redis 7.4 and later), the items are fields
+    of a hash that Redis expires itself.  Otherwise, their expiry times are
+    kept in a companion sorted set, name + ':expiry'.  Expired items are then
+    ignored by reads, and removed a batch at a time as the dict is written.
+    Either way, getting or setting an item is one round trip.
+    """
+
+    page_size = 1000
+
+    def __init__(self, name, ttl, redis=None,
+                 serializer=pickle, key_serializer=pickle, time=None,
+                 native=None, cleanup_interval=100, cleanup_batch=100):
+        """
+
+        :param name: The name of this collection - its key in Redis
+        :param ttl: How long, in seconds, items stay in the dict
+        :param redis: The StrictRedis connection to use
+        :param serializer: An object containing functions "dumps" to turn an
+            object (to store) into a byte array, and
+            "loads" to turn a byte array into an object.  Default = pickle
+        :param key_serializer: Like serializer, but applied to keys
+        :param time: a function to return the current time, as for
+            RedisTTLSet.  Only the companion sorted set layout uses it.
+        :param native: True to let Redis expire the hash fields, False to
+            keep expiry times in a companion sorted set, None to let Redis
+            expire the fields if the server supports it and time is None
+        :param cleanup_interval: With the companion sorted set, remove
+            expired items every cleanup_interval writes
+        :param cleanup_batch: The most expired items to remove at a time
+        """
+        if redis is None:
+            redis = _default_redis()
+        self.redis = redis
+        self.name = name
+        self.expiry_name = _expiry_key(name)
+        self.serializer = serializer
+        self.key_serializer = key_serializer
+        self.ttl = ttl
+        self.time = time or RedisTime.shared(redis).time
+        self.native = native
+        if native is None and time is not None:
+            self.native = False
+        self.cleanup_interval = cleanup_interval
+        self.cleanup_batch = cleanup_batch
+        self.__writes = 0
+
+    def __is_native(self):
+        if self.native is None:
+            self.native = _has_hash_field_ttl(self.redis)
+        return self.native
+
+    def __live(self, expiry):
+        return expiry is not None and expiry >= self.time()
+
+    def __getitem__(self, key):
+        """O(1)"""
+        field = self.key_serializer.dumps(key)
+        if self.__is_native():
+            val = self.redis.hget(self.name, field)
+        else:
+            expiry, val = self.redis.pipeline(). \
+                zscore(self.expiry_name, field). \
+                hget(self.name, field).execute()
+            if not self.__live(expiry):
+                val = None
+        if val is None:
+            raise KeyError(str(key))
+        return self.serializer.loads(val)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        """
+        Set an item, O(1), or O(log N) with the companion sorted set
+        :param key: the key to set
+        :param value: the value to set
+        :param ttl: how long, in seconds, this item should live, default is
+            the ttl of the dict
+        """
+        key.__hash__()  # raise a TypeError if it isn't immutable
+        ttl = self.ttl if ttl is None else ttl
+        field = self.key_serializer.dumps(key)
+        pipe = self.redis.pipeline()
+        pipe.hset(self.name, field, self.serializer.dumps(value))
+        if self.__is_native():
+            pipe.execute_command('HPEXPIRE', self.name, int(ttl * 1000),
+                                 'FIELDS', 1, field)
+        else:
+            now = self.time()
+            pipe.zadd(self.expiry_name, now + ttl, field)
+            self.__writes += 1
+            if self.__writes >= self.cleanup_interval:
+                self.__writes = 0
+                _SWEEP_HASH(pipe, keys=[self.name, self.expiry_name],
+                            args=[repr(now), self.cleanup_batch])
+        _execute(pipe)
+
+    def __delitem__(self, key):
+        field = self.key_serializer.dumps(key)
+        if self.__is_native():
+            if not self.redis.hdel(self.name, field):
+                raise KeyError(str(key))
+            return
+        expiry, deleted, _ = self.redis.pipeline(). \
+            zscore(self.expiry_name, field). \
+            hdel(self.name, field). \
+            zrem(self.expiry_name, field).execute()
+        if not (deleted and self.__live(expiry)):
+            raise KeyError(str(key))
+
+    def __contains__(self, key):
+        """O(1), without transferring the value"""
+        field = self.key_serializer.dumps(key)
+        if self.__is_native():
+            return self.redis.hexists(self.name, field)
+        return self.__live(self.redis.zscore(self.expiry_name, field))
+
+    def __fields(self):
+        """
+        Generate the names of the unexpired fields, a page at a time, each
+        page starting after the last field of the one before
+        """
+        page = self.redis.zrangebyscore(
+            self.expiry_name, self.time(), '+inf', start=0,
+            num=self.page_size, withscores=True, score_cast_func=bytes)
+        while True:
+            yield [field for field, expiry in page]
+            if len(page) < self.page_size:
+                return
+            flat = _SCORE_PAGE(self.redis, keys=[self.expiry_name],
+                               args=list(page[-1]) + [self.page_size, 0])
+            page = list(zip(flat[::2], flat[1::2]))
+
+    def __iter__(self):
+        if self.__is_native():
+            for k, v in self.redis.hscan_iter(self.name):
+                yield self.key_serializer.loads(k)
+            return
+        for page in self.__fields():
+            for k in page:
+                yield self.key_serializer.loads(k)
+
+    def items(self):
+        if self.__is_native():
+            for k, v in self.redis.hscan_iter(self.name):
+                yield self.key_serializer.loads(k), self.serializer.loads(v)
+            return
+        for page in self.__fields():
+            if not len(page):
+                continue
+            for k, v in zip(page, self.redis.hmget(self.name, page)):
+                if v is not None:
+                    yield self.key_serializer.loads(k), \
+                        self.serializer.loads(v)
+
+    def iteritems(self):
+        return self.items()
+
+    def __len__(self):
+        """
+        :return: The number of unexpired items.  O(1), or O(log N) with the
+            companion sorted set
+        """
+        if self.__is_native():
+            return self.redis.hlen(self.name)
+        return self.redis.zcount(self.expiry_name, self.time(), '+inf')
+
+    def sweep(self, limit=None):
+        """
+        Remove expired items from the companion sorted set layout.  Natively
+        expiring fields need no sweeping.
+        :param limit: The most items to remove, default is cleanup_batch
+        :return: The number of items removed
+        """
+        if self.__is_native():
+            return 0
+        return _SWEEP_HASH(self.redis, keys=[self.name, self.expiry_name],
+                           args=[repr(self.time()),
+                                 limit or self.cleanup_batch])
+
+    def clear(self):
+        self.redis.delete(self.name, self.expiry_name)
+
+    def __repr__(self):
+        return _repr(self, box='{%s}')
+
+
+class TTLSweeper(object):
+    """
+    Removes expired items from TTL collections in the background, a bounded
+    batch at a time, so readers don't pay to clean up a backlog and
+    collections nobody reads still shrink.  Collections are held by weak
+    reference, so registering one doesn't keep it alive.
+    """
+
+    def __init__(self, interval=1, batch=1000, callback=None):
+        """
+        :param interval: The time, in seconds, between sweeps
+        :param batch: The most items to remove from each collection per sweep
+        :param callback: A function(collection, count) called after each
+            collection is swept, with the number of items removed
+        """
+        self.interval = interval
+        self.batch = batch
+        self.callback = callback
+        self.last_expired = 0
+        self.total_expired = 0
+        self.sweeps = 0
+        self.last_error = None
+        self.__refs = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def register(self, collection):
+        """
+        :param collection: A RedisTTLSet, RedisTTLDict or anything else with
+            a sweep(limit) method
+        """
+        with self.__lock:
+            self.__refs.append(weakref.ref(collection))
+
+    def unregister(self, collection):
+        with self.__lock:
+            self.__refs = [r for r in self.__refs
+                           if r() is not None and r() is not collection]
+
+    def sweep(self):
+        """
+        Sweep each registered collection once.  An error sweeping one, or
+        from the callback, is kept in last_error, and the rest are still
+        swept.
+        :return: The number of items removed
+        """
+        with self.__lock:
+            self.__refs = [r for r in self.__refs if r() is not None]
+            refs = list(self.__refs)
+        expired = 0
+        for ref in refs:
+            collection = ref()
+            if collection is None:
+                continue
+            try:
+                count = collection.sweep(self.batch)
+                expired += count
+                if self.callback is not None:
+                    self.callback(collection, count)
+            except Exception as e:
+                # e.g. a lost connection, or a failing callback.  Try again
+                # next time.
+                self.last_error = e
+        self.last_expired = expired
+        self.total_expired += expired
+        self.sweeps += 1
+        return expired
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.sweep()
+
+    def start(self):
+        """Start sweeping in a daemon thread"""
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='TTLSweeper')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """Stop sweeping, waiting for a sweep in progress to finish"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
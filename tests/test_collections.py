@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import itertools
 import pytest
+from redis.client import BasePipeline, StrictRedis
+from redis.exceptions import ConnectionError, ResponseError
 from pyredis import \
-    RedisSortedSet, RedisDict, RedisSet, RedisList, ObjectRedis
+    RedisSortedSet, RedisDict, RedisSet, RedisList, RedisCappedList, \
+    RedisCounter, ObjectRedis
 from pyredis._compat import OrderedDict
 import pickle
+import time
+from .conftest import skip_if_server_version_lt
 
 
 class TestRedisList(object):
@@ -94,6 +100,35 @@ class TestRedisList(object):
                "7, 8, 9, 10, …])>" == str(a_list)
 
 
+class TestRedisCappedList(object):
+    def test_capped(self, sr):
+        a_list = RedisCappedList('l', 3, redis=sr)
+        a_list.append(1)
+        a_list.append(2)
+        assert [1, 2] == list(a_list)
+        a_list.extend([3, 4])
+        assert [2, 3, 4] == list(a_list)
+        a_list.extend(range(10))
+        assert [7, 8, 9] == list(a_list)
+        assert 3 == sr.llen('l')
+        a_list.insert(0, 'x')
+        assert [7, 8, 9] == list(a_list)
+        a_list.insert(1, 'y')
+        assert ['y', 8, 9] == list(a_list)
+        a_list.extend([])
+        assert 3 == len(a_list)
+
+        with pytest.raises(ValueError):
+            RedisCappedList('l', 0, redis=sr)
+
+    def test_tail(self, sr):
+        a_list = RedisCappedList('l', 100, redis=sr)
+        a_list.extend(range(10))
+        assert [7, 8, 9] == a_list.tail(3)
+        assert list(range(10)) == a_list.tail(20)
+        assert [] == a_list.tail(0)
+
+
 class TestObjectRedis(object):
     def test_basic_dict(self, sr):
         d = ObjectRedis(sr)
@@ -180,6 +215,240 @@ class TestObjectRedis(object):
         ort = ObjectRedis(redis=sr)
         assert "<ObjectRedis(namespace=None,{})>" == str(ort)
 
+    def test_wrapper_cache(self, sr):
+        d = ObjectRedis(sr, wrapper_cache=2)
+        d['a'] = [1, 2]
+        d['b'] = set([3])
+        d['c'] = {'x': 4}
+        a = d['a']
+        assert a is d['a']
+        assert d['b'] is d['b']
+        assert d['c'] is d['c']
+        assert a is not d['a']  # evicted by c
+        d['a'].append(3)
+        assert [1, 2, 3] == list(d['a'])
+        b = d['b']
+        d['b'] = [5]
+        assert isinstance(d['b'], RedisList)
+        assert b is not d['b']
+        del d['b']
+        with pytest.raises(KeyError):
+            d['b']
+        assert "<RedisList(name=" in repr(a)
+        with pytest.raises(AttributeError):
+            a.extra = 1
+
+        uncached = ObjectRedis(sr)
+        assert uncached['a'] is not uncached['a']
+
+    def test_typed_accessors(self, sr):
+        d = ObjectRedis(sr, namespace='ns', wrapper_cache=10)
+        d.list_at('l').extend([1, 2])
+        d.set_at('s').add(3)
+        d.dict_at('d')['k'] = 4
+        d.sorted_set_at('z')['m'] = 5
+        assert [1, 2] == list(d['l'])
+        assert set([3]) == set(d['s'])
+        assert {'k': 4} == dict(d['d'].items())
+        assert {'m': 5} == dict(d['z'].items())
+        assert d.list_at('l') is d['l']
+        assert isinstance(d.set_at('l'), RedisSet)
+
+    def test_clear(self, sr):
+        d = ObjectRedis(sr, namespace='a*')
+        d.add_index('n', lambda v: v if isinstance(v, int) else None)
+        for i in range(30):
+            d[i] = i
+        d['list'] = [1, 2]
+        other = ObjectRedis(sr, namespace='ab')
+        other['keep'] = 1
+        assert 31 == len(d)
+        d.clear()
+        assert 0 == len(d)
+        assert [] == d.query('n')
+        assert 1 == other['keep']
+
+        everything = ObjectRedis(sr)
+        everything['x'] = 1
+        sr.set('not pickled', 1)
+        everything.clear()
+        assert [b'not pickled'] == [k for k in sr.keys() if b'ab' not in k]
+
+    def test_nested_namespaces(self, sr):
+        outer = ObjectRedis(sr, namespace='ns')
+        inner = ObjectRedis(sr, namespace='ns:::x')
+        outer['a'] = 1
+        inner['b'] = 2
+        assert ['a'] == list(outer)
+        copy = outer.copy_to('copy')
+        assert ['a'] == list(copy)
+        assert [] == sr.keys(b'copy:::x:::*')
+        outer.rename_namespace('moved')
+        assert ['a'] == list(outer)
+        assert 2 == inner['b']
+        outer = ObjectRedis(sr, namespace='ns')
+        outer['c'] = 3
+        outer.clear()
+        assert 0 == len(outer)
+        assert {'b': 2} == dict(inner.items())
+
+    def test_rename_namespace(self, monkeypatch, sr):
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 7)
+        d = ObjectRedis(sr, namespace='old', wrapper_cache=5)
+        d.add_index('n', lambda v: v if isinstance(v, int) else None)
+        for i in range(20):
+            d[i] = i
+        d['set'] = set([1])
+        d.set('ttl', 'x', ttl=100)
+        d.rename_namespace('old:::nested')
+        assert 0 == len(ObjectRedis(sr, namespace='old:::nested:::nested'))
+        assert 22 == len(d)
+        assert set([1]) == set(d['set'])
+        assert [3, 4] == d.query('n', 3, 4)
+        assert 0 < sr.ttl(d._ns('ttl')) <= 100
+        assert 22 == len(sr.keys(b'old:::nested:::*'))
+        assert [b'-=-INDEX-=-old:::nested:::n'] == sr.keys(b'-=-INDEX*')
+
+    @skip_if_server_version_lt('6.2.0')
+    def test_copy_to(self, sr):
+        d = ObjectRedis(sr, namespace='src')
+        d['a'] = 1
+        d['b'] = [1, 2]
+        d.set('c', 'x', ttl=100)
+        c = d.copy_to('dst')
+        assert {'a': 1, 'c': 'x'} == dict((k, c[k]) for k in ('a', 'c'))
+        assert [1, 2] == list(c['b'])
+        assert 0 < sr.ttl(c._ns('c')) <= 100
+        d['a'] = 2
+        d.copy_to('dst')
+        assert 1 == c['a']
+        d.copy_to('dst', replace=True)
+        assert 2 == c['a']
+
+    def test_rename_namespace_expired(self, monkeypatch, sr):
+        d = ObjectRedis(sr, namespace='old')
+        d['a'] = 1
+        stored_keys = d._stored_keys
+
+        def expired(*args):
+            # A key that expires between the scan and the rename
+            return itertools.chain(stored_keys(*args), [d._ns('gone')])
+
+        monkeypatch.setattr(d, '_stored_keys', expired)
+        d.rename_namespace('new')
+        assert {'a': 1} == dict(d.items())
+
+    def test_copy_to_dump_restore(self, monkeypatch, sr):
+        execute_command = sr.execute_command
+
+        def no_copy(*args, **kwargs):
+            if args[0] == 'COPY':
+                raise ResponseError("unknown command 'COPY'")
+            return execute_command(*args, **kwargs)
+
+        monkeypatch.setattr(sr, 'execute_command', no_copy)
+        d = ObjectRedis(sr, namespace='src')
+        d['a'] = 1
+        d['b'] = [1, 2]
+        d.set('c', 'x', ttl=100)
+        c = ObjectRedis(sr, namespace='dst')
+        c['a'] = 9
+        d.copy_to('dst')
+        assert {'a': 9, 'c': 'x'} == dict((k, c[k]) for k in ('a', 'c'))
+        assert [1, 2] == list(c['b'])
+        assert 0 < sr.ttl(c._ns('c')) <= 100
+        d.copy_to('dst', replace=True)
+        assert 1 == c['a']
+
+        def corrupt(pipe, name, ttl, value, replace=False):
+            return restore(pipe, name, ttl, b'corrupt', replace)
+
+        restore = StrictRedis.restore
+        monkeypatch.setattr(BasePipeline, 'restore', corrupt, raising=False)
+        with pytest.raises(ResponseError):
+            d.copy_to('other')
+
+    def test_pipelined_scripts(self, monkeypatch, sr):
+        from redis.client import BasePipeline
+        d = ObjectRedis(sr, namespace='scripts')
+        d.add_index('name', lambda v: v, lex=True)
+        d['a'] = 'x'
+        immediate = []
+        original = BasePipeline.immediate_execute_command
+
+        def record(pipe, *args, **options):
+            immediate.append(args[0])
+            return original(pipe, *args, **options)
+
+        monkeypatch.setattr(BasePipeline, 'immediate_execute_command', record)
+        d['b'] = 'y'
+        del d['a']
+        assert [] == immediate  # Loaded once, not checked every time
+        sr.script_flush()
+        d['c'] = 'z'
+        assert ['SCRIPT LOAD'] == immediate
+        assert ['b', 'c'] == d.query('name')
+
+    def test_index(self, sr):
+        def field(name):
+            return lambda v: v.get(name) if hasattr(v, 'get') else None
+
+        d = ObjectRedis(sr, namespace='people')
+        d['carol'] = {'name': 'Carol', 'age': 41}
+        d.add_index('age', field('age'))
+        d.add_index('name', field('name'), lex=True)
+        d.reindex('age')
+        d.reindex('name')
+        d['alice'] = {'name': 'Alice', 'age': 30}
+        d['bob'] = {'name': 'Bob', 'age': 25}
+        d['dave'] = 'no age'.split()
+        d['eve'] = {'name': 'Eve'}
+        d.add_index('length', len)
+        assert ['bob', 'alice', 'carol'] == d.query('age')
+        assert ['alice', 'carol'] == d.query('age', 30, 41)
+        assert ['alice'] == d.query('age', max=40, offset=1, count=1)
+        assert ['bob', 'carol'] == d.query('name', 'B', 'Carol')
+        assert ['alice', 'bob', 'carol', 'eve'] == d.query('name')
+        assert [('alice', {'name': 'Alice', 'age': 30})] == \
+            [(k, dict(v.items())) for k, v in d.query('age', 30, 30, True)]
+
+        d['alice'] = {'name': 'Zoe', 'age': 50}
+        d.set('bob', 'string', ttl=30)
+        assert ['carol', 'alice'] == d.query('age')
+        assert ['carol', 'eve', 'alice'] == d.query('name')
+        # dave was stored before the index was added
+        assert ['alice', 'bob'] == d.query('length', 2, 6)
+        assert [('bob', 'string')] == d.query('length', 6, 6, values=True)
+        del d['alice']
+        assert ['carol'] == d.query('age')
+        assert ['carol', 'eve'] == d.query('name')
+        with pytest.raises(KeyError):
+            del d['alice']
+        with pytest.raises(ValueError):
+            d['frank'] = {'name': 'a\x00b'}
+
+        d.drop_index('name')
+        d['gina'] = {'name': 'Gina'}
+        with pytest.raises(KeyError):
+            d.query('name')
+        assert 2 == len(sr.keys(b'-=-INDEX*'))
+
+    def test_index_expired(self, sr):
+        d = ObjectRedis(sr, namespace='people')
+        d.add_index('age', lambda v: v)
+        d.add_index('name', str, lex=True)
+        for age in range(10):
+            d.set(age, age, ttl=30 if age % 3 else None)
+        # Expire the keys with a ttl behind the indexes' backs
+        for age in range(10):
+            if age % 3:
+                sr.delete(d._ns(age))
+        assert [6, 9] == d.query('age', 1, offset=1, count=2)
+        assert [(6, 6)] == d.query('age', 1, offset=1, count=1, values=True)
+        assert [0, 3, 6, 9] == d.query('name')
+        assert [4, 4] == [sr.zcard(k) for k in sr.keys(b'-=-INDEX-=-*')]
+        assert [4] == [sr.hlen(k) for k in sr.keys(b'-=-INDEX-REVERSE-*')]
+
 
 class TestRedisDict(object):
     def test_values(self, sr):
@@ -209,6 +478,58 @@ class TestRedisDict(object):
         # back to the client twice.
         assert {'a': 'A', 'c': 'C'} == dict(d.items())
 
+    def test_bulk(self, sr):
+        d = RedisDict('foo', redis=sr)
+        d.update({'a': 1, 'b': 2}, c=3)
+        d.update([('d', 4)])
+        d.update({})
+        assert {'a': 1, 'b': 2, 'c': 3, 'd': 4} == dict(d.items())
+        assert [1, None, 4] == d.get_many(['a', 'x', 'd'])
+        assert [1, 0] == d.get_many(['a', 'x'], 0)
+        assert [] == d.get_many([])
+        assert 'a' in d
+        assert 'x' not in d
+        assert 2 == d.get('b')
+        assert d.get('x') is None
+        assert 'y' == d.get('x', 'y')
+        assert set([1, 2, 3, 4]) == set(d.values())
+        with pytest.raises(TypeError):
+            d.update({('a', ['b']): 1})
+
+    def test_pop(self, sr):
+        d = RedisDict('foo', redis=sr)
+        d.update({'a': 1, 'b': 2})
+        assert 1 == d.pop('a')
+        assert 'a' not in d
+        with pytest.raises(KeyError):
+            d.pop('a')
+        assert 'gone' == d.pop('a', 'gone')
+        assert d.pop('a', None) is None
+
+        assert 2 == d.setdefault('b', 3)
+        assert 3 == d.setdefault('c', 3)
+        assert d.setdefault('n') is None
+        assert {'b': 2, 'c': 3, 'n': None} == dict(d.items())
+
+        popped = dict(d.popitem() for _ in range(3))
+        assert {'b': 2, 'c': 3, 'n': None} == popped
+        with pytest.raises(KeyError):
+            d.popitem()
+
+    def test_eq(self, sr):
+        a = RedisDict('a', redis=sr)
+        b = RedisDict('b', redis=sr)
+        a.update({'x': 1, 'y': [2]})
+        assert a != b
+        b.update({'x': 1, 'y': [3]})
+        assert a != b
+        b['y'] = [2]
+        assert a == b
+        assert a == {'x': 1, 'y': [2]}
+        b['z'] = 3
+        assert a != b
+        assert a == a
+
     def test_repr(self, sr):
         d = RedisDict('foo', redis=sr)
         refd = {'sunshine': 'rainbows', 'moon': 'eclipse'}
@@ -221,6 +542,84 @@ class TestRedisDict(object):
             "{'sunshine': 'rainbows', 'moon': 'eclipse'})>" == str(d)
 
 
+class TestRedisCounter(object):
+    def test_counter(self, sr):
+        c = RedisCounter('foo', redis=sr)
+        assert 0 == c['a']
+        assert 1 == c.increment('a')
+        assert 3 == c.increment('a', 2)
+        assert 0.5 == c.increment('b', 0.5)
+        c.update('abracadabra')
+        c.update({'z': 2}, y=1)
+        assert 8 == c['a']
+        assert 0.5 == c['b'] - 2
+        assert 2 == c['z']
+        c.subtract(['z'])
+        assert 1 == c['z']
+        assert [('a', 8), ('b', 2.5)] == c.most_common(2)
+        assert 'a' == c.most_common()[0][0]
+        del c['b']
+        del c['b']
+        assert 3 == sum(1 for x in c.elements() if x == 'r' or x == 'y')
+        assert b'8' == sr.hget('foo', pickle.dumps('a'))
+
+        with pytest.raises(TypeError):
+            c.increment(['nohash'])
+
+    def test_buffered(self, sr):
+        c = RedisCounter('foo', redis=sr, flush_interval=60)
+        assert c.increment('a') is None
+        c.update(['a', 'b'])
+        assert 0 == c['a']
+        c.flush()
+        assert 2 == c['a']
+        assert 1 == c['b']
+
+        c = RedisCounter('foo', redis=sr, flush_interval=0.01)
+        c.increment('a', 3)
+        time.sleep(0.2)
+        assert 5 == c['a']
+
+    def test_buffered_errors(self, monkeypatch, sr):
+        c = RedisCounter('foo', redis=sr, flush_interval=60)
+        c['f'] = 0.5
+        execute = BasePipeline.execute
+
+        def lost(pipe, raise_on_error=True):
+            raise ConnectionError('lost')
+
+        def lost_second(pipe, raise_on_error=True):
+            if raise_on_error:
+                raise ConnectionError('lost')
+            return execute(pipe, raise_on_error)
+
+        c.update(['a', 'a', 'f'])
+        monkeypatch.setattr(BasePipeline, 'execute', lost)
+        with pytest.raises(ConnectionError):
+            c.flush()
+        assert 0 == c['a']
+        # The integer increments are sent, but not the fractional ones
+        monkeypatch.setattr(BasePipeline, 'execute', lost_second)
+        with pytest.raises(ConnectionError):
+            c.flush()
+        monkeypatch.undo()
+        assert 2 == c['a']
+        assert 0.5 == c['f']
+        c.flush()
+        assert 2 == c['a']
+        assert 1.5 == c['f']
+
+        # A failed flush is tried again later
+        c.flush_interval = 0.01
+        c.increment('a')
+        monkeypatch.setattr(BasePipeline, 'execute', lost)
+        with pytest.raises(ConnectionError):
+            c.flush()
+        monkeypatch.undo()
+        time.sleep(0.2)
+        assert 3 == c['a']
+
+
 class TestRedisSortedSet(object):
     def test_sorted(self, sr):
         s = RedisSortedSet('foo', redis=sr)
@@ -256,6 +655,79 @@ class TestRedisSortedSet(object):
         with pytest.raises(StopIteration):
             next(i)
 
+    def test_paged(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        s.page_size = 3
+        s.update(dict((str(i), i) for i in range(10)))
+        assert [str(i) for i in range(10)] == list(s)
+        assert [(str(i), i) for i in range(9, -1, -1)] == \
+            list(s.items(reverse=True))
+        assert [str(i) for i in range(9, -1, -1)] == list(reversed(s))
+
+    def test_slice(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        s.update(dict((str(i), i) for i in range(10)))
+        ref = [str(i) for i in range(10)]
+        for index in (slice(0, 3), slice(None, None), slice(8, None),
+                      slice(-3, None), slice(2, -2), slice(-5, 8),
+                      slice(0, 0), slice(5, 2), slice(None, -10),
+                      slice(20, 30), slice(None, None, 2),
+                      slice(None, None, -1)):
+            assert ref[index] == s[index]
+
+    def test_score_range(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        s.page_size = 2
+        s.update(dict((str(i), i) for i in range(10)))
+        assert ['3', '4', '5'] == list(s.score_range(3, 5))
+        assert ['4', '5'] == list(s.score_range('(3', 5))
+        assert ['5', '4', '3'] == list(s.score_range(3, 5, reverse=True))
+        assert [('8', 8), ('9', 9)] == \
+            list(s.score_range(8, withscores=True))
+        assert ['5', '6', '7'] == list(s.score_range(offset=5, count=3))
+        assert ['4', '3'] == \
+            list(s.score_range(max=5, reverse=True, offset=1, count=2))
+        assert [] == list(s.score_range(20))
+
+    def test_score_range_ties(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        s.page_size = 3
+        s.update(dict(('%02d' % i, i // 4) for i in range(12)))
+
+        def keys(*numbers):
+            return ['%02d' % i for i in numbers]
+
+        assert keys(*range(12)) == list(s.score_range())
+        assert keys(4, 5, 6, 7) == list(s.score_range(1, '(2'))
+        assert keys(*range(7, -1, -1)) == \
+            list(s.score_range(0, 1, reverse=True))
+        assert keys(2, 3, 4, 5, 6) == list(s.score_range(offset=2, count=5))
+        it = s.score_range()
+        assert keys(0, 1, 2) == [next(it) for _ in range(3)]
+        del s['02']
+        # The next page starts after the score the deleted key had
+        assert keys(*range(4, 12)) == list(it)
+
+    def test_lex_range(self, sr):
+        class Utf8(object):
+            @staticmethod
+            def dumps(x):
+                return x.encode('utf-8')
+
+            @staticmethod
+            def loads(x):
+                return x.decode('utf-8')
+
+        s = RedisSortedSet('foo', redis=sr, serializer=Utf8)
+        s.page_size = 2
+        s.update(dict((w, 0) for w in ['apple', 'banana', 'cherry', 'date']))
+        assert ['banana', 'cherry'] == list(s.lex_range('b', 'd'))
+        assert ['cherry', 'date'] == \
+            list(s.lex_range('banana', include_min=False))
+        assert ['date', 'cherry', 'banana', 'apple'] == \
+            list(s.lex_range(reverse=True))
+        assert ['banana'] == list(s.lex_range(offset=1, count=1))
+
     def test_update(self, sr):
         s = RedisSortedSet('foo', redis=sr)
         s.update({'red': 650, 'green': 510, 'blue': 475})
@@ -265,6 +737,151 @@ class TestRedisSortedSet(object):
         od['red'] = 650
         assert od == OrderedDict(s.items())
 
+    def test_chunked_update(self, sr, monkeypatch):
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 7)
+        s = RedisSortedSet('foo', redis=sr)
+        s.update(('k%d' % i, i) for i in range(100))
+        assert 100 == len(s)
+        assert ['k99', 'k98'] == s[-1:-3:-1]
+        s.update([('k0', 200)], k1=300)
+        assert [('k1', 300), ('k0', 200)] == s.top(2)
+        s.update([('x', 1), ('x', 2)])
+        assert 2 == s['x']
+
+    def test_arrays(self, sr, monkeypatch):
+        numpy = pytest.importorskip('numpy')
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 7)
+        s = RedisSortedSet('foo', redis=sr)
+        s.page_size = 5
+        scores = numpy.array([0.1, 2.0 / 3, -1e300, float('inf'), 42.0])
+        s.from_arrays(['a', 'b', 'c', 'd', ('e', 1)], scores)
+        assert 0.1 == s['a']
+        assert 2.0 / 3 == s['b']
+        members, values = s.to_arrays()
+        assert ['c', 'a', 'b', ('e', 1), 'd'] == list(members)
+        assert values.dtype == numpy.float64
+        assert sorted(scores.tolist()) == values.tolist()
+        members, values = s.to_arrays(order='desc')
+        assert ['d', ('e', 1), 'b', 'a', 'c'] == list(members)
+        s.from_arrays(list(range(100)), numpy.arange(100) * 0.5)
+        assert 105 == len(s)
+        assert 49.5 == s[99]
+        with pytest.raises(ValueError):
+            s.from_arrays(['a'], [1, 2])
+        with pytest.raises(ValueError):
+            s.to_arrays(order='up')
+
+    def test_eq(self, sr):
+        a = RedisSortedSet('a', redis=sr)
+        b = RedisSortedSet('b', redis=sr)
+        assert a == b
+        a.update({'x': 1, 'y': 2})
+        assert a != b
+        b.update({'x': 1, 'y': 3})
+        assert a != b
+        b['y'] = 2
+        assert a == b
+        assert a == {'x': 1, 'y': 2}
+        b['z'] = 0
+        assert a != b
+        a['z'] = 0
+        assert a == b
+        a['w'] = float('inf')
+        b['w'] = float('inf')
+        assert a == b
+        del b['z']
+        b['v'] = 0
+        assert a != b
+
+    def test_leaderboard(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        assert 5.0 == s.increment('alice', 5)
+        assert 6.0 == s.increment('alice')
+        assert {'alice': 8.0, 'bob': 3.0} == \
+            s.increment_many({'alice': 2, 'bob': 3})
+        s.update({'carol': 4, 'dave': 1})
+        assert [('alice', 8.0), ('carol', 4.0)] == s.top(2)
+        assert [('dave', 1.0), ('bob', 3.0)] == s.bottom(2)
+        assert [] == s.top(0)
+        assert (2, 4.0) == s.rank_with_score('carol')
+        assert (1, 4.0) == s.rank_with_score('carol', reverse=True)
+        with pytest.raises(ValueError):
+            s.rank_with_score('eve')
+
+        assert 1 == s.set_scores({'alice': 1, 'eve': 2}, nx=True)
+        assert 8.0 == s['alice']
+        assert 0 == s.set_scores({'bob': 5, 'frank': 2}, xx=True)
+        assert 5.0 == s['bob']
+        assert 'frank' not in s
+        assert 0 == s.set_scores({})
+
+        assert [('dave', 1.0), ('eve', 2.0)] == s.pop_min(2)
+        assert [('alice', 8.0)] == s.pop_max()
+        assert [('bob', 5.0), ('carol', 4.0)] == s.pop_max(5)
+        assert [] == s.pop_min()
+
+    @skip_if_server_version_lt('6.2.0')
+    def test_set_scores_gt(self, sr):
+        s = RedisSortedSet('foo', redis=sr)
+        s.update({'bob': 5, 'carol': 4})
+        assert 1 == s.set_scores({'bob': 9, 'carol': 1}, gt=True, ch=True)
+        assert (9.0, 4.0) == (s['bob'], s['carol'])
+        assert 0 == s.set_scores({'bob': 10, 'carol': 1}, lt=True)
+        assert (9.0, 1.0) == (s['bob'], s['carol'])
+
+    def test_combine(self, sr):
+        a = RedisSortedSet('a', redis=sr)
+        b = RedisSortedSet('b', redis=sr)
+        c = RedisSortedSet('c', redis=sr)
+        a.update({'x': 1, 'y': 2, 'z': 3})
+        b.update({'y': 10, 'z': 20, 'w': 30})
+        c.update({'z': 100})
+        assert [('x', 1), ('y', 12), ('z', 23), ('w', 30)] == \
+            list(a.union([b]))
+        assert [('x', 2), ('y', 14), ('w', 30), ('z', 126)] == \
+            list(a.union([b, c], weights=[2, 1, 1]))
+        assert ['x', 'y', 'z', 'w'] == \
+            list(a.union([b], aggregate='min', withscores=False))
+        assert [('y', 10), ('z', 20)] == \
+            list(a.intersection([b], aggregate='max'))
+        assert [('z', 123)] == list(a.intersection([b, c]))
+        assert [('x', 1)] == list(a.difference([b]))
+        assert [('x', 1), ('y', 2)] == list(a.difference([c]))
+        assert ['w'] == list(b.difference([a, c], withscores=False))
+        assert not [k for k in sr.keys() if b'COMBINING' in k]
+
+        u = a.union_store('u', [b], weights=[1, -1])
+        assert {'x': 1, 'y': -8, 'z': -17, 'w': -30} == dict(u.items())
+        i = a.intersection_store('i', [b, c])
+        assert {'z': 123} == dict(i.items())
+        d = a.difference_store('a', [c])
+        assert {'x': 1, 'y': 2} == dict(d.items())
+        assert {'x': 1, 'y': 2} == dict(a.items())
+
+        with pytest.raises(TypeError):
+            a.union([{'x': 1}])
+        with pytest.raises(TypeError):
+            a.difference([{'x': 1}])
+        with pytest.raises(ValueError):
+            a.intersection([b], weights=[1])
+        with pytest.raises(ValueError):
+            a.union_store('u', [b], weights=[1])
+
+    def test_difference_pages(self, monkeypatch, sr):
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 3)
+        a = RedisSortedSet('a', redis=sr)
+        b = RedisSortedSet('b', redis=sr)
+        a.update(dict((i, i) for i in range(10)))
+        b.update(dict((i, i) for i in range(0, 10, 3)))
+        assert [1, 2, 4, 5, 7, 8] == list(a.difference([b], False))
+        assert [] == list(b.difference([a]))
+        a.difference_store('a', [b])
+        assert [1, 2, 4, 5, 7, 8] == list(a)
+        assert -1 == sr.ttl('a')
+        b.difference_store('a', [b])
+        assert 0 == len(a)
+        assert not [k for k in sr.keys() if b'COMBINING' in k]
+
     def test_hashable_key(self, sr):
         s = RedisSortedSet('foo', redis=sr)
         with pytest.raises(TypeError):
@@ -311,6 +928,12 @@ class TestRedisSet(object):
         s.update(tuple(ref))
         assert ref == set(s)
 
+    def test_chunked_update(self, sr, monkeypatch):
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 7)
+        s = RedisSet('bar', redis=sr)
+        s.update((i for i in range(100)), [200])
+        assert set(range(100)) | set([200]) == set(s)
+
     def test_update_with_nothing(self, sr):
         s = RedisSet('bar', sr)
         s.update([])  # should have no effect
@@ -337,6 +960,95 @@ class TestRedisSet(object):
         s.clear()
         assert 0 == len(s)
 
+    def test_contains_many(self, sr):
+        s = RedisSet('foo', redis=sr)
+        s.update(['a', 'b', 3])
+        assert [True, False, True, False] == \
+            s.contains_many(['a', 'c', 3, (3,)])
+        assert [] == s.contains_many([])
+
+    def test_pop_and_sample(self, sr):
+        s = RedisSet('foo', redis=sr)
+        ref = set(range(10))
+        s.update(ref)
+        sample = s.sample(3)
+        assert 3 == len(sample) == len(set(sample))
+        assert set(sample) <= ref
+        assert 10 == len(s.sample(-10))
+        assert 10 == len(s)
+
+        popped = set([s.pop()])
+        popped.update(s.pop_many(4))
+        assert 5 == len(popped)
+        assert 5 == len(s)
+        popped.update(s.pop_many(10))
+        assert ref == popped
+        assert 0 == len(s)
+        assert [] == s.pop_many(3)
+        with pytest.raises(KeyError):
+            s.pop()
+
+    def test_algebra(self, sr):
+        a = RedisSet('a', sr)
+        b = RedisSet('b', sr)
+        a.update([1, 2, 3, 4])
+        b.update([3, 4, 5])
+        assert set([3, 4]) == a & b
+        assert set([1, 2, 3, 4, 5]) == a | b
+        assert set([1, 2]) == a - b
+        assert set([1, 2, 5]) == a ^ b
+        assert set([3, 4]) == a & set([3, 4, 5])
+        assert set([1, 2]) == a - set([3, 4, 5])
+        assert set([1, 2]) == a.difference(b, [3])
+
+        c = a.union_store('c', b)
+        assert isinstance(c, RedisSet)
+        assert set([1, 2, 3, 4, 5]) == set(c)
+        assert set([3, 4]) == a.intersection(b, c)
+        assert set([1, 2]) == set(a.difference_store('c', b))
+        assert set([4]) == set(a.intersection_store('c', b, [4, 5]))
+
+        assert not a.isdisjoint(b)
+        assert a.isdisjoint(RedisSet('c', sr, pickle) - b)
+        assert RedisSet('c', sr, pickle) <= a
+        assert RedisSet('c', sr, pickle) < a
+        assert not a <= b
+        assert a >= RedisSet('c', sr, pickle)
+        assert not a > a
+        assert a <= a
+
+    def test_eq(self, sr):
+        a = RedisSet('a', sr)
+        b = RedisSet('b', sr)
+        a.update([1, 2])
+        b.update([1])
+        assert a != b
+        b.add(3)
+        assert a != b
+        b.discard(3)
+        b.add(2)
+        assert a == b
+        assert a == set([1, 2])
+
+    def test_algebra_in_place(self, sr):
+        a = RedisSet('a', sr)
+        b = RedisSet('b', sr)
+        a.update([1, 2, 3, 4])
+        b.update([3, 4, 5])
+        a ^= b
+        assert set([1, 2, 5]) == set(a)
+        a |= b
+        assert set([1, 2, 3, 4, 5]) == set(a)
+        a -= b
+        assert set([1, 2]) == set(a)
+        a |= [3]
+        a &= b
+        assert set([3]) == set(a)
+        a.update(b)
+        assert set([3, 4, 5]) == set(a)
+        a -= set([5])
+        assert set([3, 4]) == set(a)
+
     def test_repr(self, sr):
         s = RedisSet('bar', sr)
         s.update(['foo', 'bar'])
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import pytest
+import time
+from pyredis import RedisDict, RedisMirror, RedisSortedSet
+
+__author__ = 'ke4roh'
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def notify(sr, name, event):
+    """Publish a keyspace notification, as a configured server would"""
+    sr.publish('__keyspace@9__:' + name, event)
+
+
+class TestRedisMirror(object):
+    def test_dict(self, sr):
+        d = RedisDict('ref', redis=sr)
+        d.update(('k%d' % i, i) for i in range(50))
+        with RedisMirror(d, debounce=0.01) as m:
+            m.page_size = 7
+            assert 1 == m.version
+            assert 50 == len(m)
+            assert 7 == m['k7']
+            assert not m.stale
+            assert 0 == m.staleness
+            d['new'] = 'value'
+            assert 'new' not in m
+            notify(sr, 'ref', 'hset')
+            assert wait_for(lambda: 'new' in m)
+            assert 2 == m.version
+            assert not m.stale
+            assert "<RedisMirror(name='ref',{" in repr(m)
+        d['after'] = 1
+        notify(sr, 'ref', 'hset')
+        time.sleep(0.1)
+        assert 'after' not in m
+        m.refresh()
+        assert 'after' in m
+
+    def test_sorted_set(self, sr):
+        z = RedisSortedSet('scores', redis=sr)
+        z.update({'b': 2, 'a': 1, 'c': 3})
+        m = RedisMirror(z, listen=False)
+        assert ['a', 'b', 'c'] == list(m)
+        assert [('a', 1), ('b', 2), ('c', 3)] == list(m.items())
+        z['a'] = 4
+        m.refresh()
+        assert ['b', 'c', 'a'] == list(m)
+        m.close()
+
+    def test_dict_changes(self, monkeypatch, sr):
+        d = RedisDict('ref', redis=sr, publish_changes=True)
+        d.update(('k%d' % i, i) for i in range(50))
+        with RedisMirror(d, debounce=0.01) as m:
+            def reload(*args, **kwargs):
+                raise AssertionError('reloaded')
+
+            monkeypatch.setattr(sr, 'hscan_iter', reload)
+            d['new'] = 'value'
+            d.update({'k1': 'one', 'k2': 'two'})
+            del d['k3']
+            assert 'value' == d.pop('new')
+            d.setdefault('k4', 'ignored')
+            d.popitem()
+            assert wait_for(lambda: len(m) == 48 and m.get('k1') == 'one')
+            # Field writes were published, so their notifications are
+            # ignored
+            version = m.version
+            notify(sr, 'ref', 'hset')
+            time.sleep(0.05)
+            assert version == m.version and not m.stale
+            monkeypatch.undo()
+            assert dict(d.items()) == dict(m.items())
+            d.clear()
+            assert wait_for(lambda: len(m) == 0)
+
+    def test_bad_changes(self, sr):
+        d = RedisDict('ref', redis=sr, publish_changes=True)
+        d['a'] = 1
+        with RedisMirror(d, debounce=0.01, max_delay=0.05) as m:
+            # A malformed change message
+            sr.publish(d.changes, b'\x00')
+            assert wait_for(lambda: m.last_error is not None)
+            # A value that can't be unpickled
+            sr.hset('ref', d.key_serializer.dumps('b'), b'not pickled')
+            m.last_error = None
+            d['c'] = 3
+            assert wait_for(lambda: m.last_error is not None)
+            assert m.stale
+            # Still following, once the value is fixed
+            d['b'] = 2
+            assert wait_for(lambda: {'a': 1, 'b': 2, 'c': 3} == dict(m))
+            assert wait_for(lambda: not m.stale)
+
+    def test_sorted_set_changes(self, sr):
+        z = RedisSortedSet('scores', redis=sr, publish_changes=True)
+        z.update({'b': 2, 'a': 1, 'c': 3})
+        with RedisMirror(z, debounce=0.01) as m:
+            z['a'] = 4
+            z.increment('b', 10)
+            z['d'] = 0
+            del z['c']
+            z.pop_min()
+            assert wait_for(lambda: ['a', 'b'] == list(m))
+            assert [('a', 4), ('b', 12)] == list(m.items())
+            z.update({'e': 5, 'f': 5})
+            z.increment_many({'a': 2})
+            assert wait_for(lambda: 4 == len(m))
+            assert ['e', 'f', 'a', 'b'] == list(m)
+            assert 6 == m['a']
+
+    def test_refresh_unchanged(self, sr):
+        d = RedisDict('ref', redis=sr)
+        m = RedisMirror(d, listen=False)
+        states = []
+        hscan_iter = sr.hscan_iter
+
+        def load(*args, **kwargs):
+            states.append(m.stale)
+            return hscan_iter(*args, **kwargs)
+
+        sr.hscan_iter = load
+        m.refresh()
+        assert [False] == states
+        assert 2 == m.version
+
+    def test_max_age(self, sr):
+        d = RedisDict('ref', redis=sr)
+        m = RedisMirror(d, max_age=0.05)
+        d['x'] = 1
+        assert wait_for(lambda: 'x' in m)
+        m.close()
+
+    def test_type(self, sr):
+        with pytest.raises(TypeError):
+            RedisMirror({'a': 1})
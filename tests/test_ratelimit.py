@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import pytest
+from pyredis import FixedWindowLimiter, SlidingWindowLimiter, \
+    TokenBucketLimiter
+
+__author__ = 'ke4roh'
+
+
+class Clock(object):
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestSlidingWindowLimiter(object):
+    def test_allow(self, sr):
+        clock = Clock(100)
+        limiter = SlidingWindowLimiter('api', 3, 10, redis=sr, time=clock)
+        assert limiter.allow('alice')
+        clock.t = 105
+        assert limiter.allow('alice', cost=2)
+        assert not limiter.allow('alice')
+        assert limiter.allow('bob')
+        clock.t = 110
+        assert limiter.allow('alice')  # the first use has left the window
+        assert not limiter.allow('alice')
+        clock.t = 115
+        assert not limiter.allow('alice', cost=3)
+        assert limiter.allow('alice', cost=2)
+        limiter.reset('alice')
+        assert limiter.allow('alice', cost=3)
+        assert 0 < sr.pttl(limiter._key('alice')) <= 10000
+
+    def test_allow_many(self, sr):
+        clock = Clock(100)
+        limiter = SlidingWindowLimiter('api', 2, 10, redis=sr, time=clock)
+        assert [True, True, True] == limiter.allow_many(['a', 'b', 'a'])
+        assert [False, True] == limiter.allow_many(['a', 'b'])
+        assert [] == limiter.allow_many([])
+        # Reloaded if the server forgets the script
+        sr.script_flush()
+        assert [False, True] == limiter.allow_many(['a', 'c'])
+
+    def test_server_clock(self, sr):
+        limiter = SlidingWindowLimiter('api', 2, 10, redis=sr)
+        assert [True, True, False] == limiter.allow_many(['a'] * 3)
+
+
+class TestFixedWindowLimiter(object):
+    def test_allow(self, sr):
+        clock = Clock(100)
+        limiter = FixedWindowLimiter('api', 3, 10, redis=sr, time=clock)
+        assert limiter.allow('alice', cost=2)
+        clock.t = 109.5
+        assert limiter.allow('alice')
+        assert not limiter.allow('alice')
+        assert [True, False] == limiter.allow_many(['bob', 'alice'])
+        assert 0 < sr.pttl(limiter._key('alice')) <= 500
+        clock.t = 110
+        assert limiter.allow('alice', cost=3)
+        assert not limiter.allow('alice')
+
+
+class TestTokenBucketLimiter(object):
+    def test_allow(self, sr):
+        clock = Clock(100)
+        limiter = TokenBucketLimiter('api', 4, 2, redis=sr, time=clock)
+        assert limiter.allow('alice', cost=3)
+        assert limiter.allow('alice')
+        assert not limiter.allow('alice')
+        clock.t = 100.5
+        assert limiter.allow('alice')
+        assert not limiter.allow('alice')
+        clock.t = 110
+        assert limiter.allow('alice', cost=4)
+        assert not limiter.allow('alice', cost=5)
+        assert [True, False] == limiter.allow_many(['bob', 'alice'])
+        assert 0 < sr.pttl(limiter._key('alice')) <= 2001
+
+    def test_rate(self, sr):
+        for rate in (0, -1):
+            with pytest.raises(ValueError):
+                TokenBucketLimiter('api', 4, rate, redis=sr)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import time
+from pyredis import Scheduler
+
+__author__ = 'ke4roh'
+
+
+class Clock(object):
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestScheduler(object):
+    def test_claim_due(self, sr):
+        clock = Clock(100)
+        s = Scheduler('jobs', redis=sr, visibility_timeout=30, time=clock)
+        s.schedule('a', at=110)
+        s.schedule('b', delay=5)
+        s.schedule(('c', 3), at=120)
+        assert 3 == len(s)
+        assert [] == s.claim_due(5)
+        clock.t = 110
+        assert ['b', 'a'] == s.claim_due(5)
+        assert 1 == len(s)
+        assert 'a' in s
+        assert [] == s.claim_due(5)
+        assert s.ack('b')
+        assert not s.ack('b')
+        assert 'b' not in s
+
+        # 'a' times out and is claimed again
+        clock.t = 141
+        assert [('c', 3), 'a'] == s.claim_due(5, visibility_timeout=10)
+        assert s.release(('c', 3), delay=5)
+        assert not s.release(('c', 3))
+        assert [] == s.claim_due()
+        clock.t = 146
+        assert [('c', 3)] == s.claim_due()
+        clock.t = 152
+        assert 1 == s.requeue_expired()
+        assert 1 == len(s)
+        s.clear()
+        assert 0 == len(s)
+        assert [] == sr.keys('jobs*')
+
+    def test_claim(self, sr):
+        s = Scheduler('jobs', redis=sr)
+        s.poll_interval = 0.01
+        assert s.claim(timeout=0.05) is None
+        s.schedule('soon', delay=0.1)
+        start = time.time()
+        assert 'soon' == s.claim(timeout=5)
+        assert 0.05 < time.time() - start < 2
+        s.schedule('now')
+        assert 'now' == s.claim()
+        # Rung for 'now', which was claimed without waiting
+        assert [b'ring'] == sr.zrange('jobs:doorbell', 0, -1)
+
+    def test_wait_modes(self, monkeypatch, sr):
+        execute_command = sr.execute_command
+        for version, whole in (('5.0.0', True), ('6.0.0', False)):
+            s = Scheduler('jobs', redis=sr)
+            timeouts = []
+
+            def bzpopmin(*args, **kwargs):
+                if args[0] != 'BZPOPMIN':
+                    return execute_command(*args, **kwargs)
+                timeouts.append(args[2])
+                time.sleep(0.01)
+
+            monkeypatch.setattr(sr, 'info', lambda *args: {
+                'redis_version': version})
+            monkeypatch.setattr(sr, 'execute_command', bzpopmin)
+            assert s.claim(timeout=0.05) is None
+            monkeypatch.undo()
+            assert timeouts
+            if whole:
+                assert set(['1']) == set(timeouts)
+            else:
+                assert all(0 < float(t) <= 0.05 for t in timeouts)
+                assert '1' not in timeouts
+        monkeypatch.setattr(sr, 'info', lambda *args: {
+            'redis_version': '4.0.0'})
+        monkeypatch.setattr(sr, 'execute_command', bzpopmin)
+        timeouts = []
+        s = Scheduler('jobs', redis=sr)
+        s.poll_interval = 0.01
+        assert s.claim(timeout=0.05) is None
+        assert [] == timeouts
+
+    def test_doorbell(self, monkeypatch, sr):
+        s = Scheduler('jobs', redis=sr)
+        for i in range(100):
+            s.schedule(i, delay=100 + i)
+        assert sr.zcard('jobs:doorbell') <= 1
+        claims = []
+        execute_command = sr.execute_command
+
+        def record(*args, **kwargs):
+            if args[0] in ('EVALSHA', 'EVAL'):
+                claims.append(args[0])
+            return execute_command(*args, **kwargs)
+
+        monkeypatch.setattr(sr, 'execute_command', record)
+        assert s.claim(timeout=0.3) is None
+        monkeypatch.undo()
+        assert len(claims) <= 5
+        # Only an item due sooner than the rest rings
+        sr.delete('jobs:doorbell')
+        s.schedule('later', delay=500)
+        assert 0 == sr.zcard('jobs:doorbell')
+        s.schedule('soon', delay=0.05)
+        assert 1 == sr.zcard('jobs:doorbell')
+        assert 'soon' == s.claim(timeout=5)
+        assert 101 == len(s)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import io
+import pytest
+from redis.client import BasePipeline, StrictRedis
+from pyredis import ObjectRedis, dump_namespace, restore_namespace
+
+__author__ = 'ke4roh'
+
+
+def snapshot(objects):
+    f = io.BytesIO()
+    dump_namespace(objects, f)
+    f.seek(0)
+    return f
+
+
+class TestSnapshot(object):
+    def test_round_trip(self, monkeypatch, sr):
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 7)
+        d = ObjectRedis(sr, namespace='src')
+        for i in range(30):
+            d[i] = i
+        d['list'] = [1, 2]
+        d.set('ttl', 'x', ttl=100)
+        ObjectRedis(sr, namespace='other')['a'] = 1
+        f = io.BytesIO()
+        assert 32 == dump_namespace(d, f)
+        f.seek(0)
+
+        copy = ObjectRedis(sr, namespace='dst')
+        copy.add_index('n', lambda v: v if isinstance(v, int) else None)
+        assert 32 == restore_namespace(copy, f, workers=3)
+        assert dict((i, i) for i in range(30)) == \
+            dict((i, copy[i]) for i in range(30))
+        assert [1, 2] == list(copy['list'])
+        assert 0 < sr.ttl(copy._ns('ttl')) <= 100
+        assert -1 == sr.ttl(copy._ns(0))
+        assert 32 == len(copy)
+        assert [3, 4] == copy.query('n', 3, 4)
+
+    def test_expiring(self, monkeypatch, sr):
+        d = ObjectRedis(sr, namespace='src')
+        d['kept'] = 1
+        d['expiring'] = 2
+        d['vanished'] = 3
+        pttl = StrictRedis.pttl
+
+        def racing(pipe, name):
+            # As if the keys expired between DUMP and PTTL
+            if name == d._ns('expiring'):
+                return pipe.execute_command('EVAL', 'return 0', 0)
+            if name == d._ns('vanished'):
+                return pttl(pipe, b'no such key')
+            return pttl(pipe, name)
+
+        monkeypatch.setattr(BasePipeline, 'pttl', racing, raising=False)
+        f = snapshot(d)
+        monkeypatch.undo()
+        copy = ObjectRedis(sr, namespace='dst')
+        assert 1 == restore_namespace(copy, f)
+        assert ['kept'] == list(copy)
+        assert -1 == sr.ttl(copy._ns('kept'))
+
+    def test_replace(self, sr):
+        d = ObjectRedis(sr, namespace='src')
+        d['a'] = 1
+        d['b'] = 2
+        f = snapshot(d)
+        d['a'] = 3
+        del d['b']
+        assert 1 == restore_namespace(d, f)
+        assert {'a': 3, 'b': 2} == dict(d.items())
+        f.seek(0)
+        assert 2 == restore_namespace(d, f, replace=True, workers=1)
+        assert {'a': 1, 'b': 2} == dict(d.items())
+
+    def test_empty(self, sr):
+        d = ObjectRedis(sr, namespace='empty')
+        assert 0 == restore_namespace(d, snapshot(d))
+
+    def test_bad_file(self, sr):
+        d = ObjectRedis(sr, namespace='src')
+        d['a'] = 1
+        whole = snapshot(d).getvalue()
+        with pytest.raises(ValueError):
+            restore_namespace(d, io.BytesIO(b'not a snapshot'))
+        with pytest.raises(ValueError):
+            restore_namespace(d, io.BytesIO(whole[:-1]))
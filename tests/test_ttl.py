@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import pytest
-from pyredis import RedisTTLSet
+import time
+from redis.exceptions import ConnectionError
+from pyredis import RedisTime, RedisTTLDict, RedisTTLSet, TTLSweeper
 import pickle
+from .conftest import skip_if_server_version_lt
 
 __author__ = 'ke4roh'
 
@@ -28,6 +31,97 @@ class TestRedisTTLSet(object):
         s.clear()
         assert 0 == len(s)
 
+    def test_server_clock(self, sr):
+        s = RedisTTLSet('foo', 0.2, redis=sr)
+        s.add('grunge')
+        s.update(['oscar', 'abby'])
+        assert 'grunge' in s
+        assert 'nobody' not in s
+        s.discard('oscar')
+        assert 'oscar' not in s
+        time.sleep(0.25)
+        assert 'grunge' not in s
+        assert ['abby'] == [pickle.loads(k) for k in sr.zrange('foo', 0, -1)]
+
+    def test_paged_iteration(self, monkeypatch, sr):
+        t = 1
+        s = RedisTTLSet('foo', 5, redis=sr, time=lambda: t)
+        s.dict.page_size = 7
+        s.update(range(50))
+        t = 3
+        s.update(range(50, 100))
+        t = 6.5
+        offsets = []
+        zrangebyscore = sr.zrangebyscore
+
+        def record(*args, **kwargs):
+            offsets.append(kwargs.get('start'))
+            return zrangebyscore(*args, **kwargs)
+
+        monkeypatch.setattr(sr, 'zrangebyscore', record)
+        # The 50 items expiring together span several pages
+        assert list(range(50, 100)) == sorted(s)
+        # Only the first page is found by offset
+        assert [0] == offsets
+
+    def test_incremental_cleanup(self, sr):
+        t = 1
+        s = RedisTTLSet('foo', 5, redis=sr, time=lambda: t, cleanup_batch=10)
+        s.update(range(25))
+        t = 7
+        s.add('live')
+        assert 1 == len(s)
+        assert 16 == sr.zcard('foo')
+        assert ['live'] == [k for k in s]
+        assert 6 == sr.zcard('foo')
+        assert 3 == s.sweep(3)
+        assert 2 == s.sweep()
+        assert 1 == sr.zcard('foo')
+
+    def test_item_ttls(self, sr):
+        t = 100
+        s = RedisTTLSet('foo', 5, redis=sr, time=lambda: t)
+        s.add('a')
+        s.add('b', ttl=50)
+        s.update(['c', 'd'], ttl=20)
+        s.update_ttls({'e': 1, 'f': None})
+        s.update(['g'])
+        assert [105, 150, 120, 101, 105, None] == \
+            s.expires_at(['a', 'b', 'c', 'e', 'f', 'nobody'])
+        assert [] == s.expires_at([])
+        t = 102
+        assert 'e' not in s
+        assert 2 == s.touch(['a', 'c', 'e', 'nobody'], ttl=10)
+        assert 'nobody' not in s
+        assert 1 == s.touch(['g'])
+        assert [112, 112, 107, None] == s.expires_at(['a', 'c', 'g', 'e'])
+        pipe = sr.pipeline()
+        assert RedisTTLSet('foo', 5, redis=pipe,
+                           time=lambda: t).touch(['a', 'e'], 20) is None
+        assert [1] == pipe.execute()
+        t = 110
+        assert set(['a', 'b', 'c', 'd']) == set(s)
+        with pytest.raises(TypeError):
+            s.update(['h'], ttls=3)
+        # A mapping's keys are items, as for any set
+        s.update({'h': 'not a ttl'})
+        assert [115] == s.expires_at(['h'])
+
+    def test_add_without_pipeline(self, monkeypatch, sr):
+        s = RedisTTLSet('foo', 5, redis=sr)
+
+        def pipeline(*args, **kwargs):
+            raise AssertionError('pipelined')
+
+        monkeypatch.setattr(sr, 'pipeline', pipeline)
+        s.add('a')
+        s.update(['b', 'c'])
+        s.update([])
+        monkeypatch.undo()
+        monkeypatch.setattr('pyredis.collections._CHUNK_SIZE', 2)
+        s.update(['d', 'e', 'f', 'g', 'h'])
+        assert set('abcdefgh') == set(s)
+
     def test_len_cleanup(self, sr):
         t = 1
         s = RedisTTLSet('foo', 5, redis=sr, time=lambda: t)
@@ -80,3 +174,218 @@ class TestRedisTTLSet(object):
         s = RedisTTLSet('foo', 5, redis=sr)
         s.add('grunge')
         assert "<RedisTTLSet(name='foo',{'grunge'})>" == str(s)
+
+
+class TestRedisTime(object):
+    def test_shared(self, sr):
+        clock = RedisTime.shared(sr)
+        assert clock is RedisTime.shared(sr)
+        assert clock.time.__self__ is \
+            RedisTTLSet('foo', 5, redis=sr).time.__self__
+        sec, micros = sr.time()
+        assert abs(sec + micros * 1e-6 - clock.time()) < 1
+
+    def test_adaptive_refresh(self, sr, monkeypatch):
+        now = [1000.0]
+        skew = [50.0]
+
+        class Server(object):
+            def time(self):
+                now[0] += 0.002  # half the round trip
+                t = now[0] + skew[0]
+                now[0] += 0.002
+                return int(t), int(t % 1 * 1e6)
+
+        monkeypatch.setattr('pyredis.ttl.monotonic', lambda: now[0])
+        clock = RedisTime(Server(), refresh_interval=5,
+                          max_refresh_interval=20)
+        t = clock.time()
+        assert abs(now[0] + 50 - t) < 1e-5
+        assert 5 == clock.refresh_interval
+        assert abs(0.004 - clock.rtt) < 1e-9
+        now[0] += 5
+        clock.time()
+        assert 10 == clock.refresh_interval
+        now[0] += 10
+        clock.time()
+        now[0] += 20
+        clock.time()
+        assert 20 == clock.refresh_interval
+        now[0] += 3
+        assert abs(now[0] + 50 - clock.time()) < 1e-5  # no check
+        now[0] += 20
+        skew[0] = 51
+        t = clock.time()
+        assert abs(now[0] + 51 - t) < 1e-5
+        assert 10 == clock.refresh_interval
+
+
+class TestTTLSweeper(object):
+    def test_sweeper(self, sr):
+        t = 1
+        a = RedisTTLSet('a', 5, redis=sr, time=lambda: t)
+        b = RedisTTLDict('b', 5, redis=sr, time=lambda: t)
+        swept = []
+        sweeper = TTLSweeper(interval=0.01, batch=4,
+                             callback=lambda c, n: swept.append((c.name, n)))
+        sweeper.register(a)
+        sweeper.register(b)
+        a.update(range(5))
+        for i in range(3):
+            b[i] = i
+        t = 10
+        assert 7 == sweeper.sweep()
+        assert [('a', 4), ('b', 3)] == swept
+        assert 1 == sweeper.sweep()
+        assert 1 == sweeper.last_expired
+        assert 8 == sweeper.total_expired
+        assert 0 == sr.zcard('a')
+
+        sweeper.unregister(b)
+        a.add('x')
+        del b
+        sweeper.start()
+        t = 20
+        deadline = time.time() + 5
+        while sr.zcard('a') and time.time() < deadline:
+            time.sleep(0.01)
+        sweeper.stop()
+        assert 0 == sr.zcard('a')
+        assert 9 == sweeper.total_expired
+
+    def test_sweeper_errors(self, sr):
+        t = 1
+        a = RedisTTLSet('a', 5, redis=sr, time=lambda: t)
+        b = RedisTTLSet('b', 5, redis=sr, time=lambda: t)
+        swept = []
+
+        def callback(collection, count):
+            swept.append(collection.name)
+            if collection is a:
+                raise ValueError('callback failed')
+
+        sweeper = TTLSweeper(callback=callback)
+        sweeper.register(a)
+        sweeper.register(b)
+        a.update(range(3))
+        b.update(range(2))
+        t = 10
+        assert 5 == sweeper.sweep()
+        assert ['a', 'b'] == swept
+        assert isinstance(sweeper.last_error, ValueError)
+        assert 5 == sweeper.total_expired
+        assert 1 == sweeper.sweeps
+
+        def broken(limit):
+            raise ConnectionError('lost')
+
+        a.sweep = broken
+        b.add('x')
+        t = 20
+        sweeper.last_error = None
+        assert 1 == sweeper.sweep()
+        assert isinstance(sweeper.last_error, ConnectionError)
+        assert 2 == sweeper.sweeps
+
+        # The background thread keeps going too
+        sweeper.interval = 0.01
+        sweeper.start()
+        deadline = time.time() + 5
+        while sweeper.sweeps < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        sweeper.stop()
+        assert 4 <= sweeper.sweeps
+
+
+class TestRedisTTLDict(object):
+    def test_dict(self, sr):
+        t = 1
+        d = RedisTTLDict('foo', 5, redis=sr, time=lambda: t)
+        d['a'] = 'A'
+        t = 2
+        d.set('b', 'B', ttl=10)
+        d['c'] = 'C'
+        assert 'A' == d['a']
+        assert 'a' in d
+        assert 3 == len(d)
+        assert {'a': 'A', 'b': 'B', 'c': 'C'} == dict(d.items())
+        t = 6.5
+        with pytest.raises(KeyError):
+            d['a']
+        assert 'a' not in d
+        assert 2 == len(d)
+        assert set(['b', 'c']) == set(d)
+        with pytest.raises(KeyError):
+            del d['a']
+        del d['c']
+        assert {'b': 'B'} == dict(d.items())
+        t = 20
+        assert 0 == len(d)
+        assert {} == dict(d.items())
+
+        with pytest.raises(TypeError):
+            d[['nohash']] = 1
+
+    def test_cleanup(self, sr):
+        t = 1
+        d = RedisTTLDict('foo', 5, redis=sr, time=lambda: t,
+                         cleanup_interval=10, cleanup_batch=4)
+        for i in range(9):
+            d[i] = i
+        assert 9 == sr.hlen('foo')
+        t = 10
+        d['x'] = 'x'  # the tenth write sweeps up to 4 expired items
+        assert 6 == sr.hlen('foo')
+        assert 6 == sr.zcard('foo:expiry')
+        assert 5 == d.sweep(10)
+        assert 1 == sr.hlen('foo')
+        assert {'x': 'x'} == dict(d.items())
+
+        d.clear()
+        assert 0 == len(d)
+        assert not sr.exists('foo:expiry')
+
+    def test_sweep_batches(self, sr):
+        d = RedisTTLDict('foo', 5, redis=sr, time=lambda: 10)
+        pipe = sr.pipeline()
+        for i in range(2500):
+            pipe.hset('foo', i, i)
+            pipe.zadd('foo:expiry', 1, i)
+        pipe.execute()
+        assert 2200 == d.sweep(2200)
+        assert 300 == d.sweep(5000)
+        assert not sr.exists('foo')
+        assert not sr.exists('foo:expiry')
+
+    def test_paging(self, monkeypatch, sr):
+        t = 1
+        d = RedisTTLDict('foo', 5, redis=sr, time=lambda: t)
+        d.page_size = 3
+        for i in range(7):
+            d[i] = i  # sharing an expiry time
+        t = 2
+        for i in range(7, 11):
+            d[i] = i
+        starts = []
+        zrangebyscore = sr.zrangebyscore
+
+        def record(*args, **kwargs):
+            starts.append(kwargs.get('start'))
+            return zrangebyscore(*args, **kwargs)
+
+        monkeypatch.setattr(sr, 'zrangebyscore', record)
+        assert list(range(11)) == sorted(d)
+        assert dict((i, i) for i in range(11)) == dict(d.items())
+        assert [0, 0] == starts
+
+    @skip_if_server_version_lt('7.4.0')
+    def test_native(self, sr):
+        d = RedisTTLDict('foo', 0.2, redis=sr)
+        d['a'] = 'A'
+        d.set('b', 'B', ttl=5)
+        assert 'A' == d['a']
+        assert 2 == len(d)
+        assert not sr.exists('foo:expiry')
+        time.sleep(0.5)
+        assert 'a' not in d
+        assert {'b': 'B'} == dict(d.items())